@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta, timezone
-from flask import Flask, render_template, redirect, url_for, request, session, jsonify, flash, send_from_directory, g
-import requests
+from flask import Flask, render_template, stream_template, redirect, url_for, request, session, jsonify, flash, send_from_directory, g
+from flask.sessions import SecureCookieSessionInterface
 from flask_login import current_user, LoginManager, UserMixin, login_user, logout_user, login_required
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -10,7 +10,13 @@ from wtforms.validators import DataRequired, Length, EqualTo
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 from models import db, User, SearchHistory, ReadArticle, Bookmark, ArticleView, NewsSource, ManagedArticle, GlobalSettings
 import numpy as np
-from recommendation_model import RecommendationModel
+from recommendation_model import RecommendationModel, apply_interaction
+from profile_store import ProfileStore
+from news_api import NewsAPIClient, NewsAPIError, NEWS_API_BASE_URL
+from cache import TTLCache, DiskCache, TieredCache
+from rate_limit import QuotaLimiter, parse_route_budgets
+import outbound
+from ingest import ingest_headlines, run_ingestion_loop, recent_headlines, to_api_article
 from sqlalchemy import func
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import KMeans
@@ -24,10 +30,13 @@ import json
 import os
 from dotenv import load_dotenv
 from flask_migrate import Migrate
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from reader import ArticleExtractor, ImageValidator, SelectorRules, choose_images, drop_invalid_images, text_blocks
+from urllib.parse import urlparse
 from functools import wraps
 import concurrent.futures
+import contextvars
+import click
+from sqlalchemy.exc import SQLAlchemyError
 
 # Load environment variables
 load_dotenv()
@@ -37,8 +46,58 @@ FLASK_APP = os.getenv('FLASK_APP')
 NEWS_API_KEY = os.getenv('NEWS_API_KEY')
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///newsapp.db')  # Add default SQLite URL
 SECRET_KEY = os.getenv('SECRET_KEY', 'dev')  # Add default secret key
+NEWS_API_URL = os.getenv('NEWS_API_BASE_URL', NEWS_API_BASE_URL)  # Point at newsapi_standin.py for offline runs
+NEWS_API_MODE = os.getenv('NEWS_API_MODE', 'live')  # 'live', 'record' or 'replay'
+NEWS_API_CASSETTE_DIR = os.getenv('NEWS_API_CASSETTE_DIR', 'newsapi_cassettes')
+NEWS_API_CONNECT_TIMEOUT = float(os.getenv('NEWS_API_CONNECT_TIMEOUT', 3.05))
+NEWS_API_READ_TIMEOUT = float(os.getenv('NEWS_API_READ_TIMEOUT', 10))
+NEWS_API_CACHE_TTL = int(os.getenv('NEWS_API_CACHE_TTL', 300))  # Seconds a headline response is fresh
+NEWS_API_CACHE_STALE_TTL = int(os.getenv('NEWS_API_CACHE_STALE_TTL', 600))  # Extra seconds it may be served while refreshing
+NEWS_API_CACHE_SIZE = int(os.getenv('NEWS_API_CACHE_SIZE', 256))
+DISK_CACHE_PATH = os.getenv('DISK_CACHE_PATH')  # Shared by all workers on a host; defaults to the instance folder, 'off' disables
+DISK_CACHE_MAX_MB = int(os.getenv('DISK_CACHE_MAX_MB', 64))  # Size bound per cache namespace
+NEWS_API_DAILY_QUOTA = int(os.getenv('NEWS_API_DAILY_QUOTA', 100))  # Upstream requests per day, 0 disables the limiter
+NEWS_API_ROUTE_BUDGETS = parse_route_budgets(os.getenv('NEWS_API_ROUTE_BUDGETS', ''))  # e.g. "guest_news=30,get_content_recommendations=10"
+NEWS_API_QUOTA_RESERVE = float(os.getenv('NEWS_API_QUOTA_RESERVE', 0.2))  # Share of the daily quota kept for critical callers
+NEWS_API_QUOTA_DB = os.getenv('NEWS_API_QUOTA_DB')  # Defaults to a file in the instance folder
+OUTBOUND_REQUEST_DEADLINE = float(os.getenv('OUTBOUND_REQUEST_DEADLINE', 15))  # Total seconds of outbound HTTP per request
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))  # Consecutive failures before a host's circuit opens
+CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv('CIRCUIT_RECOVERY_TIMEOUT', 30))  # Seconds before an open circuit lets a probe through
+ARTICLE_CACHE_TTL = int(os.getenv('ARTICLE_CACHE_TTL', 21600))  # Seconds an extracted reader-mode article is reused
+ARTICLE_CACHE_STALE_TTL = int(os.getenv('ARTICLE_CACHE_STALE_TTL', 7 * 86400))  # Then served while revalidated with the publisher
+ARTICLE_CACHE_SIZE = int(os.getenv('ARTICLE_CACHE_SIZE', 512))  # Extracted articles kept in memory per worker
+READER_MAX_PAGE_KB = int(os.getenv('READER_MAX_PAGE_KB', 3072))  # Larger publisher pages are not parsed
+PREFETCH_ARTICLES = int(os.getenv('PREFETCH_ARTICLES', 6))  # Recommended articles extracted ahead of a click; 0 disables
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 2))  # Background threads per worker doing that extraction
+READER_STREAM = os.getenv('READER_STREAM', 'false').lower() == 'true'  # Stream /read_article by default (?stream=0/1 overrides)
+EXTRACT_PROCESSES = int(os.getenv('EXTRACT_PROCESSES', 2))  # Parser processes per worker for large pages; 0 parses in-thread
+EXTRACT_TIMEOUT = float(os.getenv('EXTRACT_TIMEOUT', 10))  # Seconds a page may take to parse before it's abandoned
+EXTRACT_INLINE_KB = int(os.getenv('EXTRACT_INLINE_KB', 32))  # Smaller pages are parsed in-thread
+READER_HTML_PARSER = os.getenv('READER_HTML_PARSER')  # 'lxml' or 'html.parser'; defaults to the fastest installed
+IMAGE_CHECK_BUDGET = float(os.getenv('IMAGE_CHECK_BUDGET', 3))  # Seconds a page may spend validating its images
+IMAGE_CHECK_PER_HOST = int(os.getenv('IMAGE_CHECK_PER_HOST', 4))  # Concurrent image checks against one host
+IMAGE_CHECK_TTL = int(os.getenv('IMAGE_CHECK_TTL', 86400))  # Seconds an image check result is reused
+RECOMMENDATION_FETCH_TIMEOUT = float(os.getenv('RECOMMENDATION_FETCH_TIMEOUT', 8))  # Overall deadline for the upstream fan-out
+RECOMMENDATION_PROFILE_DB = os.getenv('RECOMMENDATION_PROFILE_DB')  # SQLite file for user profiles (default: instance/user_profiles.db)
+RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', 86400))  # Seconds lists from 'flask refresh-recommendations' are served
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', 4096))  # Precomputed lists kept in memory per worker
+INGEST_INTERVAL = int(os.getenv('INGEST_INTERVAL', 14400))  # Seconds between headline ingestion runs (7 calls each)
+INGEST_MAX_AGE = int(os.getenv('INGEST_MAX_AGE', 2 * INGEST_INTERVAL))  # Ingested headlines older than this are ignored
+INGEST_DAILY_BUDGET = int(os.getenv('INGEST_DAILY_BUDGET', 42))  # NewsAPI calls per day ingestion may use, 6 runs at the default interval
+# Ingestion gets its own bucket so it can't spend the quota user-facing searches need
+NEWS_API_ROUTE_BUDGETS.setdefault('ingest_news', INGEST_DAILY_BUDGET)
+
+class PublicResponseSessionInterface(SecureCookieSessionInterface):
+    """Don't save the session (Set-Cookie, Vary: Cookie) on responses a shared cache may store"""
+
+    def save_session(self, app, session, response):
+        if response.cache_control.public:
+            # The cookie carries the CSRF token, so a cached copy would hand one visitor's session to everyone
+            return
+        super().save_session(app, session, response)
 
 app = Flask(__name__)
+app.session_interface = PublicResponseSessionInterface()
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -48,8 +107,75 @@ csrf.init_app(app)
 # Initialize extensions
 db.init_app(app)
 migrate = Migrate(app, db)
-# Initialize the recommendation model
-recommendation_model = RecommendationModel()
+# Initialize the recommendation model; user profiles live in their own SQLite store
+recommendation_model = RecommendationModel(profile_store=ProfileStore(
+    RECOMMENDATION_PROFILE_DB or os.path.join(app.instance_path, 'user_profiles.db'),
+    apply_interaction
+))
+def make_cache(namespace, max_entries, ttl, stale_ttl=0):
+    """Build an in-process cache, backed by the host-wide disk cache unless it is disabled"""
+    memory = TTLCache(max_entries=max_entries, ttl=ttl, stale_ttl=stale_ttl)
+    if DISK_CACHE_PATH == 'off':
+        return memory
+    disk = DiskCache(
+        DISK_CACHE_PATH or os.path.join(app.instance_path, 'cache.db'),
+        namespace=namespace,
+        max_bytes=DISK_CACHE_MAX_MB * 1024 * 1024,
+        ttl=ttl,
+        stale_ttl=stale_ttl
+    )
+    return TieredCache(memory, disk)
+
+# Shared NewsAPI client with a pooled session used by every route
+news_api = NewsAPIClient(
+    NEWS_API_KEY,
+    base_url=NEWS_API_URL,
+    mode=NEWS_API_MODE,
+    cassette_dir=NEWS_API_CASSETTE_DIR,
+    connect_timeout=NEWS_API_CONNECT_TIMEOUT,
+    read_timeout=NEWS_API_READ_TIMEOUT,
+    cache=make_cache(
+        'newsapi',
+        max_entries=NEWS_API_CACHE_SIZE,
+        ttl=NEWS_API_CACHE_TTL,
+        stale_ttl=NEWS_API_CACHE_STALE_TTL
+    ),
+    # Shared across gunicorn workers through a SQLite file
+    limiter=QuotaLimiter(
+        NEWS_API_QUOTA_DB or os.path.join(app.instance_path, 'newsapi_quota.db'),
+        daily_quota=NEWS_API_DAILY_QUOTA,
+        route_budgets=NEWS_API_ROUTE_BUDGETS,
+        reserve=NEWS_API_QUOTA_RESERVE
+    )
+)
+# Reader mode extraction, cached per canonical article URL
+article_extractor = ArticleExtractor(
+    make_cache('articles', max_entries=ARTICLE_CACHE_SIZE, ttl=ARTICLE_CACHE_TTL, stale_ttl=ARTICLE_CACHE_STALE_TTL),
+    rules=SelectorRules(make_cache('selector_rules', max_entries=1024, ttl=7 * 86400)),
+    parser=READER_HTML_PARSER,
+    max_bytes=READER_MAX_PAGE_KB * 1024,
+    prefetch_workers=PREFETCH_WORKERS,
+    processes=EXTRACT_PROCESSES,
+    parse_timeout=EXTRACT_TIMEOUT,
+    inline_bytes=EXTRACT_INLINE_KB * 1024,
+    background_deadline=OUTBOUND_REQUEST_DEADLINE
+)
+# Reader mode image checks, run concurrently and cached per image URL
+image_validator = ImageValidator(
+    make_cache('images', max_entries=4096, ttl=IMAGE_CHECK_TTL),
+    per_host=IMAGE_CHECK_PER_HOST,
+    budget=IMAGE_CHECK_BUDGET
+)
+# Per-user lists written by 'flask refresh-recommendations', keyed by str(user id); the disk
+# tier carries them to the web workers
+precomputed_recommendations = make_cache(
+    'recommendations', max_entries=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL
+)
+# Circuit breakers are per upstream host and shared by every outbound call
+outbound.breakers.failure_threshold = CIRCUIT_FAILURE_THRESHOLD
+outbound.breakers.recovery_timeout = CIRCUIT_RECOVERY_TIMEOUT
+# Worker threads for issuing independent upstream calls in parallel
+upstream_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='upstream')
 
 COUNTRIES = {
     "US": "United States",
@@ -72,35 +198,57 @@ def before_request():
     if 'csrf_token' not in session:
         session['csrf_token'] = generate_csrf()
 
+@app.before_request
+def start_outbound_deadline():
+    # Every outbound call made while handling this request draws from one time budget
+    g.outbound_deadline = outbound.start_deadline(OUTBOUND_REQUEST_DEADLINE)
+
+@app.teardown_request
+def clear_outbound_deadline(exc):
+    token = g.pop('outbound_deadline', None)
+    if token is not None:
+        outbound.clear_deadline(token)
+
 @app.after_request
 def after_request(response):
-    response.headers.set('X-CSRFToken', session.get('csrf_token', ''))
+    # Never let a shared cache store one visitor's CSRF token for everyone (the session cookie is
+    # left off public responses too, see PublicResponseSessionInterface)
+    if not response.cache_control.public:
+        response.headers.set('X-CSRFToken', session.get('csrf_token', ''))
     return response
 
+def cached_json(payload, max_age, private=False, last_modified=None):
+    """jsonify a feed with an ETag and Cache-Control, answering 304 if the client's copy is current"""
+    response = jsonify(payload)
+    # Keys are sorted when serialising, so equal payloads always hash to the same ETag
+    response.add_etag()
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if last_modified:
+        response.last_modified = last_modified
+    return response.make_conditional(request)
+
 @app.route("/get_recommended_articles")
 @login_required
 def get_recommended_articles():
     try:
+        # Serve the batch-precomputed list when there is one, skipping the fan-out and scoring
+        articles = precomputed_recommendations.get(str(current_user.id))
+        if articles:
+            if PREFETCH_ARTICLES:
+                article_extractor.prefetch(article['url'] for article in articles[:PREFETCH_ARTICLES] if article.get('url'))
+            return cached_json({'articles': articles[:6]}, max_age=60, private=True)
         articles = []
         
-        # Always get trending/breaking news first
-        url = f"https://newsapi.org/v2/top-headlines?apiKey={NEWS_API_KEY}&pageSize=15&language=en"
-        response = requests.get(url)
-        if response.ok:
-            articles_data = response.json().get('articles', [])
-            # Add category to each article
-            for article in articles_data:
-                # Try to determine category from source or section if available
-                article['category'] = article.get('category') or \
-                                    article.get('source', {}).get('category') or \
-                                    'general'  # Default category
-            articles.extend(articles_data)
-        
         # If user has history, enhance with personalized content
         user_history = ReadArticle.query.filter_by(user_id=current_user.id)\
             .order_by(ReadArticle.read_at.desc())\
             .limit(20).all()
-            
+        
+        categories = []
         if user_history:
             # Add category-based articles
             categories = db.session.query(
@@ -112,21 +260,51 @@ def get_recommended_articles():
             ).group_by(ReadArticle.category)\
             .order_by(func.count(ReadArticle.category).desc())\
             .limit(2).all()
-            
-            for category in categories:
-                params = {
-                    'apiKey': NEWS_API_KEY,
-                    'category': category[0],
-                    'pageSize': 5,
-                    'language': 'en'
-                }
-                response = requests.get(url, params=params)
-                if response.ok:
-                    category_articles = response.json().get('articles', [])
-                    # Add category to each article
-                    for article in category_articles:
-                        article['category'] = category[0]
-                    articles.extend(category_articles)
+        
+        # Trending/breaking news first, then the user's top categories
+        feeds = [(None, 15)] + [(category[0], 5) for category in categories]
+        
+        # Serve what we can from ingested headlines and fetch the rest at the same time
+        results = {}
+        fetches = {}
+        for category, page_size in feeds:
+            ingested = get_ingested_headlines(page_size, category)
+            if ingested is not None:
+                results[category] = ingested
+            else:
+                # Personalised category extras are nice to have; trending news is not
+                # Run in a copy of this context so the call shares the request's deadline
+                fetches[upstream_executor.submit(
+                    contextvars.copy_context().run,
+                    news_api.top_headlines,
+                    page_size=page_size,
+                    category=category,
+                    route='get_recommended_articles',
+                    critical=category is None
+                )] = category
+        
+        done, pending = concurrent.futures.wait(fetches, timeout=RECOMMENDATION_FETCH_TIMEOUT)
+        for future in pending:
+            future.cancel()
+            print(f"Timed out fetching {fetches[future] or 'trending'} headlines")
+        for future in done:
+            try:
+                results[fetches[future]] = future.result()
+            except NewsAPIError as e:
+                print(f"Error fetching {fetches[future] or 'trending'} headlines: {e}")
+        
+        # Use whatever finished, keeping trending news first
+        for category, _ in feeds:
+            fetched = results.get(category, [])
+            for article in fetched:
+                if category:
+                    article['category'] = category
+                else:
+                    # Try to determine category from source or section if available
+                    article['category'] = article.get('category') or \
+                                        article.get('source', {}).get('category') or \
+                                        'general'  # Default category
+            articles.extend(fetched)
         
         # Process all articles
         articles = merge_recommendations(articles, [])  # Remove duplicates
@@ -140,21 +318,42 @@ def get_recommended_articles():
                 article['category'] = 'general'
         
         articles.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+
+        # The next request is usually a click on one of these, so have reader mode ready for it
+        if PREFETCH_ARTICLES:
+            article_extractor.prefetch(article['url'] for article in articles[:PREFETCH_ARTICLES] if article.get('url'))
         
-        return jsonify({'articles': articles[:6]})
+        # Personalised, so only the user's own browser may keep it
+        return cached_json({'articles': articles[:6]}, max_age=60, private=True)
         
     except Exception as e:
         print(f"Error in recommendations: {e}")
-        # Fallback to basic news if anything fails
-        url = f"https://newsapi.org/v2/top-headlines?apiKey={NEWS_API_KEY}&pageSize=6&language=en"
-        response = requests.get(url)
-        if response.ok:
-            articles = response.json().get('articles', [])
-            # Add default category
-            for article in articles:
-                article['category'] = 'general'
-            return jsonify({'articles': articles})
-        return jsonify({'error': str(e)}), 500
+        # Fall back to whatever basic news we already have; calling NewsAPI
+        # again right after a failure would only pile more load on it
+        articles = get_ingested_headlines(6) or news_api.cached_headlines(page_size=15)[:6]
+        if not articles:
+            return jsonify({'error': str(e)}), 500
+        # Add default category
+        for article in articles:
+            article['category'] = 'general'
+        return jsonify({'articles': articles})
+
+def get_ingested_headlines(page_size, category=None):
+    """Read headlines from the ingested ManagedArticle table, or None if there are none"""
+    try:
+        return recent_headlines(INGEST_MAX_AGE, page_size, category=category)
+    except SQLAlchemyError as e:
+        print(f"Error reading ingested headlines: {e}")
+        db.session.rollback()
+        return None
+
+def get_headlines(page_size=None, category=None, route=None, critical=True):
+    """Serve headlines from local ingestion when available, otherwise from NewsAPI"""
+    articles = get_ingested_headlines(page_size or 20, category)  # NewsAPI's default page size
+    if articles is not None:
+        return articles
+    return news_api.top_headlines(page_size=page_size, category=category,
+                                  route=route, critical=critical)
 
 def get_similar_users(user_id, limit=5):
     """Find users with similar reading patterns"""
@@ -297,58 +496,39 @@ def get_news():
     # Handle both initial page load and form submissions
     if request.method == 'GET':
         # Show default news on initial page load
-        url = f"https://newsapi.org/v2/top-headlines"
-        params = {
-            'apiKey': NEWS_API_KEY,
-            'language': 'en',
-            'pageSize': 30
-        }
         try:
-            response = requests.get(url, params=params)
-            if response.ok:
-                articles = response.json().get('articles', [])
-                return render_template('news.html', 
-                                    articles=articles, 
-                                    form=form,
-                                    show_categories=True)
+            articles = get_headlines(page_size=30, route='get_news')
+            return render_template('news.html', 
+                                articles=articles, 
+                                form=form,
+                                show_categories=True)
         except Exception as e:
             print(f"Error fetching initial news: {e}")
             flash('Error fetching news. Please try again.', 'error')
     
     elif request.method == 'POST':
         try:
-            # Build the API URL
-            url = "https://newsapi.org/v2/top-headlines?"
-            params = {
-                'apiKey': NEWS_API_KEY,
-                'language': 'en',
-                'pageSize': 30
-            }
+            # Optional filters are dropped by the client when empty
+            articles = news_api.top_headlines(
+                page_size=30,
+                category=form.category.data,
+                q=form.keywords.data,
+                country=form.country.data,
+                route='get_news'
+            )
             
-            # Add optional parameters if provided
-            if form.category.data:
-                params['category'] = form.category.data
-            if form.keywords.data:
-                params['q'] = form.keywords.data
-            if form.country.data:
-                params['country'] = form.country.data
-                
-            response = requests.get(url, params=params)
-            if response.ok:
-                articles = response.json().get('articles', [])
-                
-                # Process articles to ensure image URLs are properly formatted
-                for article in articles:
-                    if article.get('urlToImage'):
-                        if not article['urlToImage'].startswith(('http://', 'https://')):
-                            article['urlToImage'] = f"https:{article['urlToImage']}" if article['urlToImage'].startswith('//') else f"https://{article['urlToImage']}"
-                    else:
-                        article['urlToImage'] = None
-                
-                return render_template('news.html', 
-                                     articles=articles, 
-                                     form=form,
-                                     show_categories=True)
+            # Process articles to ensure image URLs are properly formatted
+            for article in articles:
+                if article.get('urlToImage'):
+                    if not article['urlToImage'].startswith(('http://', 'https://')):
+                        article['urlToImage'] = f"https:{article['urlToImage']}" if article['urlToImage'].startswith('//') else f"https://{article['urlToImage']}"
+                else:
+                    article['urlToImage'] = None
+            
+            return render_template('news.html', 
+                                 articles=articles, 
+                                 form=form,
+                                 show_categories=True)
         except Exception as e:
             print(f"Error fetching news: {e}")
             flash('Error fetching news. Please try again.', 'error')
@@ -468,18 +648,12 @@ def guest_news():
     keywords = request.args.get('keywords', '')
     category = request.args.get('category', '')
     
-    # Build the API URL
-    url = f"https://newsapi.org/v2/top-headlines?apiKey={NEWS_API_KEY}&language=en"
-    if category:
-        url += f"&category={category}"
-    if keywords:
-        url += f"&q={keywords}"
-    
     try:
-        response = requests.get(url)
-        if response.ok:
-            articles = response.json().get('articles', [])
-            return render_template('news.html', articles=articles, form=form, is_guest=True)
+        if keywords:
+            articles = news_api.top_headlines(category=category, q=keywords, route='guest_news')
+        else:
+            articles = get_headlines(category=category, route='guest_news')
+        return render_template('news.html', articles=articles, form=form, is_guest=True)
     except Exception as e:
         print(f"Error fetching news: {e}")
     
@@ -488,10 +662,8 @@ def guest_news():
 @app.route("/get_trending_articles")
 def get_trending_articles():
     try:
-        url = f"https://newsapi.org/v2/top-headlines?apiKey={NEWS_API_KEY}&pageSize=6&language=en"
-        response = requests.get(url)
-        if response.ok:
-            return jsonify({'articles': response.json().get('articles', [])})
+        articles = get_headlines(page_size=6, route='get_trending_articles')
+        return cached_json({'articles': articles}, max_age=60)
     except Exception as e:
         print(f"Error fetching trending articles: {e}")
     return jsonify({'articles': []})
@@ -655,125 +827,23 @@ def view_article():
     # Reader mode functionality available to all users
     if mode == 'reader':
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, headers=headers)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            def is_valid_image(img_url):
-                try:
-                    img_response = requests.head(img_url, timeout=2)
-                    content_type = img_response.headers.get('content-type', '')
-                    content_length = img_response.headers.get('content-length')
-                    
-                    # Check if it's an image and has reasonable size (>1KB)
-                    is_image = content_type.startswith('image/')
-                    has_size = content_length and int(content_length) > 1000
-                    
-                    return is_image and has_size
-                except:
-                    return False
-
-            # Remove unwanted elements first
-            for element in soup(['script', 'style', 'meta', 'link', 'noscript', 'iframe', 'button', 
-                              'input', 'form', 'nav', 'header', 'footer']):
-                element.decompose()
-
-            # Find main article content (same selectors as before)
-            article_content = None
-            content_selectors = [
-                '[data-testid="article-body"]',
-                '[data-testid="article-content"]',
-                '.article__body',
-                '.article-body',
-                '.article__content',
-                '.article-content',
-                '.story__body',
-                '.story-body',
-                '.post-content',
-                '.entry-content',
-                '.main-content',
-                'article',
-                '.article',
-                'main'
-            ]
-            
-            for selector in content_selectors:
-                potential_content = soup.select_one(selector)
-                if potential_content and potential_content.find_all('p'):
-                    article_content = potential_content
-                    break
-            
-            if not article_content:
-                # Fallback to largest paragraph cluster
-                all_paragraphs = soup.find_all('p')
-                if all_paragraphs:
-                    parent_count = {}
-                    for p in all_paragraphs:
-                        if p.parent:
-                            parent_count[p.parent] = parent_count.get(p.parent, 0) + 1
-                    if parent_count:
-                        article_content = max(parent_count.keys(), key=lambda x: parent_count[x])
-            
-            if article_content:
-                # Create clean container
-                clean_content = soup.new_tag('div')
-                
-                # Process paragraphs and images
-                for element in article_content.find_all(['p', 'img', 'figure']):
-                    if element.name == 'p':
-                        # Keep non-empty paragraphs
-                        if element.get_text(strip=True):
-                            new_p = soup.new_tag('p')
-                            new_p.string = element.get_text(strip=True)
-                            clean_content.append(new_p)
-                    
-                    elif element.name == 'img':
-                        # Process and validate direct images
-                        if element.get('src'):
-                            img_url = urljoin(url, element.get('src'))
-                            if is_valid_image(img_url):
-                                new_img = soup.new_tag('img')
-                                new_img['src'] = img_url
-                                new_img['loading'] = 'lazy'
-                                if element.get('alt'):
-                                    new_img['alt'] = element.get('alt')
-                                clean_content.append(new_img)
-                    
-                    elif element.name == 'figure':
-                        # Handle and validate images within figures
-                        img = element.find('img')
-                        if img and img.get('src'):
-                            img_url = urljoin(url, img.get('src'))
-                            if is_valid_image(img_url):
-                                new_img = soup.new_tag('img')
-                                new_img['src'] = img_url
-                                new_img['loading'] = 'lazy'
-                                if img.get('alt'):
-                                    new_img['alt'] = img.get('alt')
-                                
-                                # Add caption if exists
-                                caption = element.find(['figcaption', 'caption'])
-                                if caption and caption.get_text(strip=True):
-                                    new_p = soup.new_tag('p')
-                                    new_p['class'] = 'image-caption'
-                                    new_p.string = caption.get_text(strip=True)
-                                    
-                                    clean_content.append(new_img)
-                                    clean_content.append(new_p)
-                                else:
-                                    clean_content.append(new_img)
-                
-                article_content = clean_content
-                
-                # Debug info
-                print(f"Found {len(article_content.find_all('p'))} paragraphs and {len(article_content.find_all('img'))} valid images")
-                
-            return render_template('reader_mode.html', 
-                                 content=article_content, 
+            # Fetch and extraction are cached per canonical URL, image checks per image URL
+            extracted = article_extractor.extract(url)
+            title = title or extracted['title']
+            blocks = drop_invalid_images(extracted['blocks'], image_validator)
+
+            if len(text_blocks(blocks)) < 2:
+                return render_template('article_reader_error.html',
+                                     title=title,
+                                     original_url=url,
+                                     error_message="Couldn't extract article content. This might be due to the website's structure or content protection.")
+
+            # Same reader page as /read_article, with the article's images inline
+            return render_template('article_reader.html',
                                  title=title,
-                                 original_url=url)
+                                 content=blocks,
+                                 images=[],
+                                 source_url=url)
         except Exception as e:
             print(f"Error in reader mode: {e}")
             return redirect(url)
@@ -795,7 +865,8 @@ def extract_topics(articles, num_topics=5):
     tfidf_matrix = vectorizer.fit_transform(texts)
     
     # Cluster into topics
-    kmeans = KMeans(n_clusters=num_topics)
+    # Fixed seed so the same articles always get the same topics (and feed ETags stay stable)
+    kmeans = KMeans(n_clusters=num_topics, random_state=0)
     kmeans.fit(tfidf_matrix)
     
     # Get top terms for each cluster
@@ -813,25 +884,25 @@ def get_content_recommendations(user_history, limit=20):
     """Get content-based recommendations based on user's reading history"""
     if not user_history:
         # Default recommendations if no history
-        url = f"https://newsapi.org/v2/top-headlines?apiKey={NEWS_API_KEY}&pageSize={limit}&language=en"
-        response = requests.get(url)
-        return response.json().get('articles', []) if response.ok else []
+        try:
+            return get_headlines(page_size=limit, route='get_content_recommendations', critical=False)
+        except NewsAPIError:
+            return []
     
     # Get user's preferred categories
     categories = [h.category for h in user_history if h.category]
     if categories:
-        url = f"https://newsapi.org/v2/top-headlines"
         articles = []
         for category in set(categories):
-            params = {
-                'apiKey': NEWS_API_KEY,
-                'category': category,
-                'pageSize': limit // len(set(categories)),
-                'language': 'en'
-            }
-            response = requests.get(url, params=params)
-            if response.ok:
-                articles.extend(response.json().get('articles', []))
+            try:
+                articles.extend(get_headlines(
+                    page_size=limit // len(set(categories)),
+                    category=category,
+                    route='get_content_recommendations',
+                    critical=False
+                ))
+            except NewsAPIError:
+                continue
         return articles
     return []
 
@@ -951,14 +1022,15 @@ def get_reading_history():
         ReadArticle.read_at.desc()
     ).limit(10).all()
     
-    return jsonify({
+    # Changes whenever the user opens an article, so always revalidate
+    return cached_json({
         'history': [{
             'title': h.article_title,
             'url': h.article_url,
             'read_at': h.read_at.strftime("%Y-%m-%d %H:%M"),
             'bookmarked': h.bookmarked
         } for h in history]
-    })
+    }, max_age=0, private=True, last_modified=history[0].read_at if history else None)
 
 @app.route("/bookmarks")
 @login_required
@@ -1176,26 +1248,16 @@ def favicon():
 
 def fetch_news(category=None, keywords=None, country=None):
     """Fetch news articles from the API"""
-    base_url = "https://newsapi.org/v2/top-headlines"
-    params = {
-        'apiKey': NEWS_API_KEY,
-        'pageSize': 30
-    }
-    
-    if category:
-        params['category'] = category
-    if keywords:
-        params['q'] = keywords
-    if country:
-        params['country'] = country
-    else:
-        params['country'] = 'us'  # default to US news
-        
     try:
-        response = requests.get(base_url, params=params)
-        data = response.json()
-        return data.get('articles', [])
-    except:
+        return news_api.top_headlines(
+            page_size=30,
+            category=category,
+            q=keywords,
+            country=country or 'us',  # default to US news
+            language=None,
+            route='fetch_news'
+        )
+    except NewsAPIError:
         return []
 
 @app.route('/test_csrf', methods=['GET', 'POST'])
@@ -1235,6 +1297,12 @@ def admin_dashboard():
         active_users=active_users
     )
 
+@app.route("/admin/newsapi_quota")
+@login_required
+@admin_required
+def newsapi_quota():
+    return jsonify({'remaining': news_api.limiter.remaining()})
+
 @app.route("/admin/make_admin/<int:user_id>", methods=['POST'])
 @login_required
 @admin_required
@@ -1378,11 +1446,14 @@ def manage_sources():
 
 def check_website_status(url):
     try:
-        response = requests.head(url, timeout=5)
+        response = outbound.head(url, timeout=5)
         if response.status_code == 200:
             return {'status': 'Online', 'code': 200}
         else:
             return {'status': 'Issues', 'code': response.status_code}
+    except outbound.DeadlineExceededError:
+        # Page ran out of time checking earlier sources; this one wasn't tried
+        return {'status': 'Issues', 'code': 0}
     except:
         return {'status': 'Offline', 'code': 0}
 
@@ -1579,6 +1650,32 @@ def set_user_theme(user_id):
     flash(f'Updated theme for user {user.username}', 'success')
     return redirect(url_for('admin_dashboard'))
 
+def stream_reader_blocks(url, title, preview_image):
+    """Yield /read_article content blocks as soon as each one is ready"""
+    try:
+        extracted = article_extractor.extract(url)
+    except Exception as e:
+        yield {'type': 'error', 'content': f"An error occurred while trying to read this article: {str(e)}"}
+        return
+
+    if not title and extracted['title']:
+        title = extracted['title']
+        yield {'type': 'title', 'content': title}
+
+    article_content = text_blocks(extracted['blocks'])
+    if len(article_content) < 2:
+        yield {'type': 'error', 'content': "Couldn't extract article content. This might be due to the website's structure or content protection."}
+        return
+
+    # The text is already on its way by the time the images are checked, so that happens right
+    # here rather than tying up a shared pool thread; the lead image is moved to the top with CSS
+    yield from article_content
+    try:
+        for image in choose_images(extracted, preview_image, title, image_validator):
+            yield {'type': 'lead_image', **image}
+    except Exception as e:
+        print(f"Error choosing reader images: {e}")
+
 @app.route("/read_article")
 def read_article():
     url = request.args.get('url')
@@ -1629,154 +1726,21 @@ def read_article():
             print(f"Error recording article view: {e}")
             db.session.rollback()
     
+    if request.args.get('stream', '1' if READER_STREAM else '0') == '1':
+        # Send the page shell now and the article as it's extracted
+        return stream_template('article_reader.html',
+                               title=title,
+                               content=stream_reader_blocks(url, title, preview_image),
+                               images=[],
+                               source_url=url,
+                               streamed=True)
+
     try:
-        # Fetch article content with headers to avoid blocking
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        response = requests.get(url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Extract main content
-        article_content = []
-        images = []
-        
-        # Try to find article content using common selectors
-        content_selectors = [
-            'article',
-            '[data-testid="article-body"]',
-            '.article-content',
-            '.article-body',
-            '.story-content',
-            '.story-body',
-            '.post-content',
-            '.entry-content',
-            '.content-body',
-            '.article__body',
-            '.article__content',
-            'main',
-            '#main-content',
-            '.main-content'
-        ]
-        main_content = None
-        
-        for selector in content_selectors:
-            content = soup.select(selector)
-            content = content[0] if content else None
-            if content:
-                main_content = content
-                break
-        
-        if main_content:
-            # Remove unwanted elements
-            for unwanted in main_content.select('script, style, nav, header, footer, .ad, .advertisement, .social-share, .newsletter, .share, .related-articles, .sidebar, aside'):
-                unwanted.decompose()
-            
-            # Validate preview image first if available
-            if preview_image and not any(skip in preview_image.lower() for skip in [
-                'icon', 'logo', 'avatar', 'thumb',
-                'placeholder', 'default', 'blank',
-                'bbcx/grey-placeholder',
-                'pixel.gif', 'spacer.gif'
-            ]):
-                try:
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                    }
-                    img_response = requests.head(preview_image, headers=headers, timeout=2)
-                    content_type = img_response.headers.get('content-type', '')
-                    content_length = img_response.headers.get('content-length')
-                    
-                    if content_type.startswith('image/') and content_length and int(content_length) > 1000:
-                        images.append({
-                            'src': preview_image,
-                            'alt': title,
-                            'caption': ''
-                        })
-                except:
-                    pass
-            
-            # Extract article images if preview image wasn't valid
-            if not images:
-                for img in main_content.find_all('img'):
-                    src = img.get('src', '')
-                    if src:
-                        if not src.startswith('http'):
-                            src = urljoin(url, src)
-                        if any(skip in src.lower() for skip in [
-                            'icon', 'logo', 'avatar', 'thumb',
-                            'placeholder', 'default', 'blank',
-                            'bbcx/grey-placeholder',
-                            'pixel.gif', 'spacer.gif'
-                        ]):
-                            continue
-                        
-                        try:
-                            headers = {
-                                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                            }
-                            img_response = requests.head(src, headers=headers, timeout=2)
-                            content_type = img_response.headers.get('content-type', '')
-                            content_length = img_response.headers.get('content-length')
-                            
-                            if content_type.startswith('image/') and content_length and int(content_length) > 1000:
-                                parsed = urlparse(src)
-                                if not parsed.scheme:
-                                    src = f"https:{src}" if src.startswith('//') else urljoin(url, src)
-                                images.append({
-                                    'src': src,
-                                    'alt': img.get('alt', ''),
-                                    'caption': img.get('caption', '') or img.find_next('figcaption').text if img.find_next('figcaption') else ''
-                                })
-                                break
-                        except:
-                            continue
-            
-            # If no valid image found and we have a preview image, use it
-            if not images and preview_image:
-                if not any(skip in preview_image.lower() for skip in [
-                    'placeholder', 'default', 'blank',
-                    'bbcx/grey-placeholder',
-                    'pixel.gif', 'spacer.gif'
-                ]):
-                    images.append({
-                        'src': preview_image,
-                        'alt': title,
-                        'caption': ''
-                    })
-            
-            # Extract paragraphs while preserving structure
-            for element in main_content.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote']):
-                # Skip empty elements or those containing only whitespace/special characters
-                text = element.get_text(strip=True)
-                if text and not text.isspace() and len(text) > 1:
-                    # Skip elements that are likely navigation/metadata
-                    if any(skip in str(element.get('class', [])).lower() for skip in ['nav', 'menu', 'share', 'meta', 'tag']):
-                        continue
-                    article_content.append({
-                        'type': element.name,
-                        'content': text
-                    })
-        else:
-            # Fallback to basic paragraph extraction
-            paragraphs = []
-            for p in soup.find_all('p'):
-                text = p.get_text(strip=True)
-                if text and not text.isspace() and len(text) > 1:
-                    if not any(skip in str(p.get('class', [])).lower() for skip in ['nav', 'menu', 'share', 'meta', 'tag']):
-                        paragraphs.append({
-                            'type': 'p',
-                            'content': text
-                        })
-            article_content = paragraphs
-            
-            # Use preview image if available
-            if preview_image:
-                images.append({
-                    'src': preview_image,
-                    'alt': title,
-                    'caption': ''
-                })
+        # Fetch and extraction are cached per canonical URL and shared with reader mode
+        extracted = article_extractor.extract(url)
+        title = title or extracted['title']
+        article_content = text_blocks(extracted['blocks'])
+        images = choose_images(extracted, preview_image, title, image_validator)
         
         # After content extraction, check if we actually got any content
         if not article_content or len(article_content) < 2:
@@ -1842,5 +1806,86 @@ def toggle_bookmark():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.cli.command('ingest-news')
+@click.option('--loop', is_flag=True, help='Keep ingesting every --interval seconds.')
+@click.option('--interval', default=INGEST_INTERVAL, show_default=True, help='Seconds between runs.')
+def ingest_news_command(loop, interval):
+    """Pull top headlines per category into the ManagedArticle table"""
+    if loop:
+        run_ingestion_loop(app, news_api, interval)
+    else:
+        print(f"Ingested {ingest_headlines(news_api)} articles")
+
+@app.cli.command('fit-recommendation-vocabulary')
+@click.option('--limit', default=20000, show_default=True, help='Most recent articles to fit on.')
+def fit_recommendation_vocabulary_command(limit):
+    """Fit the recommendation TF-IDF vocabulary on ingested articles"""
+    articles = ManagedArticle.query.order_by(ManagedArticle.published_at.desc()).limit(limit).all()
+    if not articles:
+        print("No articles to fit on; run 'flask ingest-news' first")
+        return
+    recommendation_model.fit_vocabulary([f"{a.title} {a.description or ''}" for a in articles])
+    print(f"Fitted {len(recommendation_model.vectorizer.vocabulary_)} terms on {len(articles)} articles")
+
+@app.cli.command('refresh-recommendations')
+@click.option('--days', default=30, show_default=True, help='Only users whose profile changed in this many days.')
+@click.option('--limit', default=500, show_default=True, help='Most recent ingested articles to rank (without --ann).')
+@click.option('--count', default=6, show_default=True, help='Recommendations per user.')
+@click.option('--ann', is_flag=True, help='Rank every ingested article through an approximate nearest-neighbour index, kept on disk and topped up with new articles each run (pays off from tens of thousands of articles).')
+@click.option('--probes', default=8, show_default=True, help='With --ann, index clusters to search per user (higher is more accurate).')
+def refresh_recommendations_command(days, limit, count, ann, probes):
+    """Precompute recommendations for every recently active user in one batched pass"""
+    if DISK_CACHE_PATH == 'off':
+        # The lists would only land in this process's memory, where no web worker can see them
+        print("The disk cache is disabled (DISK_CACHE_PATH=off), so the web workers couldn't serve precomputed recommendations")
+        return
+    user_ids = recommendation_model.profiles.user_ids(
+        updated_since=(datetime.now() - timedelta(days=days)).timestamp()
+    )
+    if ann:
+        added = index_managed_articles()
+        if not len(recommendation_model.article_index):
+            print("No ingested articles to rank; run 'flask ingest-news' first")
+            return
+        # Same fallback as the exact path for users without a profile
+        latest = get_ingested_headlines(count) or []
+        recommendations = {
+            user_id: recommended or latest
+            for user_id, recommended in recommendation_model.get_indexed_recommendations(user_ids, count, probes).items()
+        }
+        source = f"{len(recommendation_model.article_index)} indexed articles ({added} new)"
+    else:
+        articles = get_ingested_headlines(limit)
+        if not articles:
+            print("No recently ingested articles to rank; run 'flask ingest-news' first")
+            return
+        recommendations = recommendation_model.get_batch_recommendations(user_ids, articles, count)
+        source = f"{len(articles)} articles"
+    for user_id, recommended in recommendations.items():
+        precomputed_recommendations.set(str(user_id), recommended)
+    print(f"Refreshed recommendations for {len(recommendations)} users from {source}")
+
+def index_managed_articles():
+    """Add ManagedArticle rows not yet in the saved nearest-neighbour index, then save it. Returns how many were added."""
+    first_id = last_id = recommendation_model.load_index()
+    # Batches as big as the training sample, so the clusters learn from as many articles as in one go
+    batch_size = recommendation_model.article_index.sample_size
+    added = 0
+    while True:
+        rows = ManagedArticle.query.filter(ManagedArticle.id > last_id)\
+            .order_by(ManagedArticle.id).limit(batch_size).all()
+        if not rows:
+            break
+        added += recommendation_model.index_articles([to_api_article(row) for row in rows])
+        last_id = rows[-1].id
+    index = recommendation_model.article_index
+    if index.needs_rebuild():
+        # Clusters from an early, small run would make every search score a big share of the articles
+        print(f"Re-learning index clusters on {len(index)} articles (last learned on {index.trained_on})")
+        index.rebuild()
+    if last_id != first_id:
+        recommendation_model.save_index(last_id)
+    return added
+
 if __name__ == "__main__":
     app.run(debug=False)
@@ -0,0 +1,258 @@
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+
+def dense_row(vectors, row):
+    """One row of a sparse matrix as a flat dense array; sparse x dense is far faster to score than sparse x sparse"""
+    start, end = vectors.indptr[row], vectors.indptr[row + 1]
+    dense = np.zeros(vectors.shape[1], dtype=np.float32)
+    dense[vectors.indices[start:end]] = vectors.data[start:end]
+    return dense
+
+
+def top_terms(matrix, limit):
+    """Keep only each row's `limit` largest weights, so centroids stay sparse"""
+    matrix = sp.csr_matrix(matrix)
+    rows, columns, values = [], [], []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        data, indices = matrix.data[start:end], matrix.indices[start:end]
+        if len(data) > limit:
+            keep = np.argpartition(-data, limit - 1)[:limit]
+            data, indices = data[keep], indices[keep]
+        rows.append(np.full(len(data), row))
+        columns.append(indices)
+        values.append(data)
+    return sp.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+        shape=matrix.shape, dtype=np.float32
+    )
+
+
+def top_k(scores, k):
+    """Positions of the k highest scores, best first, without sorting all of them"""
+    k = min(k, len(scores))
+    if not k:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class ArticleIndex:
+    """Approximate cosine top-k over sparse article vectors with an inverted-file (IVF) index.
+
+    Articles are grouped into ``num_clusters`` clusters by spherical k-means;
+    a query compares itself with the cluster centroids and only scores the
+    articles in its ``probes`` closest clusters. More probes means better
+    recall and more articles to score; ``num_clusters`` defaults to
+    4 x sqrt(articles). The clusters are learned from the first batch added,
+    or again by rebuild(); articles added later just join their nearest
+    cluster, so call rebuild() once the collection has grown or drifted a lot
+    (needs_rebuild() says when it has grown).
+    """
+
+    def __init__(self, num_clusters=None, centroid_terms=400, iterations=8, sample_size=20000, seed=0):
+        self.num_clusters = num_clusters
+        self.centroid_terms = centroid_terms
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.centroids = None
+        # How many articles the current clusters were learned from
+        self.trained_on = 0
+        self._keys = []
+        self._items = []
+        self._ids = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._cluster_ids = []
+        self._cluster_vectors = []
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def __getstate__(self):
+        # Picklable (e.g. with joblib) apart from the lock
+        with self._lock:
+            state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def needs_rebuild(self, growth=4):
+        """Whether the index has grown to `growth` times the articles its clusters were learned from.
+
+        Clusters learned from a small first batch are too few and too broad
+        for a much bigger collection, so each query ends up scoring a large
+        share of it.
+        """
+        return bool(self.trained_on) and len(self) >= growth * self.trained_on
+
+    def train(self, vectors):
+        """Learn cluster centroids by spherical k-means on (a sample of) normalized vectors"""
+        rng = np.random.default_rng(self.seed)
+        num_clusters = self.num_clusters or int(4 * np.sqrt(vectors.shape[0]))
+        if vectors.shape[0] > self.sample_size:
+            vectors = vectors[rng.choice(vectors.shape[0], self.sample_size, replace=False)]
+        num_clusters = max(1, min(num_clusters, vectors.shape[0]))
+        centroids = vectors[rng.choice(vectors.shape[0], num_clusters, replace=False)]
+
+        for _ in range(self.iterations):
+            assigned = self.assign(vectors, centroids)
+            members = sp.csr_matrix(
+                (np.ones(len(assigned), dtype=np.float32), (assigned, np.arange(len(assigned)))),
+                shape=(num_clusters, vectors.shape[0])
+            )
+            sums = members @ vectors
+            # A cluster that lost all its articles restarts from a random one
+            empty = np.flatnonzero(members.getnnz(axis=1) == 0)
+            if len(empty):
+                sums = sp.lil_matrix(sums)
+                sums[empty] = vectors[rng.choice(vectors.shape[0], len(empty))]
+            centroids = normalize(top_terms(sums, self.centroid_terms))
+        return centroids
+
+    @staticmethod
+    def assign(vectors, centroids, batch_size=4096):
+        """Index of the closest centroid for every row"""
+        assigned = []
+        for start in range(0, vectors.shape[0], batch_size):
+            scores = (vectors[start:start + batch_size] @ centroids.T).toarray()
+            assigned.append(scores.argmax(axis=1))
+        return np.concatenate(assigned) if assigned else np.empty(0, dtype=np.int64)
+
+    def add(self, keys, vectors, items=None):
+        """Index one vector per key (e.g. article URLs). Re-adding a key replaces its vector."""
+        if not keys:
+            return
+        vectors = normalize(sp.csr_matrix(vectors, dtype=np.float32))
+        items = items if items is not None else keys
+        # A key repeated within the batch keeps its last vector, as if added one at a time
+        last = {key: row for row, key in enumerate(keys)}
+        if len(last) < len(keys):
+            rows = sorted(last.values())
+            keys, vectors, items = [keys[row] for row in rows], vectors[rows], [items[row] for row in rows]
+        # Training is the slow part, so it happens outside the lock
+        centroids = self.centroids if self.centroids is not None else self.train(vectors)
+        assigned = self.assign(vectors, centroids)
+
+        with self._lock:
+            if self.centroids is None:
+                self.centroids = centroids
+                self.trained_on = len(keys)
+                self._cluster_ids = [[] for _ in range(centroids.shape[0])]
+                self._cluster_vectors = [[] for _ in range(centroids.shape[0])]
+            for key in keys:
+                self._discard(key)
+            first = len(self._keys)
+            for offset, key in enumerate(keys):
+                self._ids[key] = first + offset
+            self._keys.extend(keys)
+            self._items.extend(items)
+
+            order = np.argsort(assigned, kind='stable')
+            bounds = np.searchsorted(assigned[order], np.arange(centroids.shape[0] + 1))
+            for cluster in np.flatnonzero(np.diff(bounds)):
+                rows = order[bounds[cluster]:bounds[cluster + 1]]
+                self._cluster_ids[cluster].append(rows + first)
+                self._cluster_vectors[cluster].append(vectors[rows])
+            # A new array rather than a resize, so searches holding the old one stay consistent
+            self._alive = np.concatenate([self._alive, np.ones(len(keys), dtype=bool)])
+
+    def remove(self, keys):
+        with self._lock:
+            for key in keys:
+                self._discard(key)
+
+    def _discard(self, key):
+        # Left in its cluster and skipped at query time; rebuild() drops it for good
+        article_id = self._ids.pop(key, None)
+        if article_id is not None:
+            self._alive[article_id] = False
+
+    def _cluster(self, cluster):
+        """A cluster's article ids and vectors, stacked lazily so adding batches stays cheap"""
+        with self._lock:
+            if cluster >= len(self._cluster_ids):
+                # Cleared since the caller looked at the centroids
+                return None, None
+            ids, vectors = self._cluster_ids[cluster], self._cluster_vectors[cluster]
+            if len(ids) > 1:
+                ids[:] = [np.concatenate(ids)]
+                vectors[:] = [sp.vstack(vectors, format='csr')]
+            return (ids[0], vectors[0]) if ids else (None, None)
+
+    def rebuild(self):
+        """Re-learn the clusters from the live articles and drop removed ones.
+
+        Searches keep using the current clusters until the new ones are ready;
+        articles added while it runs are not carried over, so run it between
+        batches of additions.
+        """
+        with self._lock:
+            num_clusters = len(self._cluster_ids)
+            items, keys, alive = self._items, self._keys, self._alive
+        parts = [self._cluster(cluster) for cluster in range(num_clusters)]
+        parts = [(ids, vectors) for ids, vectors in parts if ids is not None]
+
+        fresh = ArticleIndex(self.num_clusters, self.centroid_terms, self.iterations, self.sample_size, self.seed)
+        if parts:
+            ids = np.concatenate([ids for ids, _ in parts])
+            live = np.flatnonzero(alive[ids])
+            vectors = sp.vstack([vectors for _, vectors in parts], format='csr')[live]
+            fresh.add([keys[i] for i in ids[live]], vectors, [items[i] for i in ids[live]])
+        with self._lock:
+            for name in ('centroids', 'trained_on', '_keys', '_items', '_ids', '_alive', '_cluster_ids', '_cluster_vectors'):
+                setattr(self, name, getattr(fresh, name))
+
+    def _probe(self, query, probes):
+        """Ids and scores of the live articles in the `probes` clusters closest to a dense query, plus the item list"""
+        with self._lock:
+            centroids, alive, items = self.centroids, self._alive, self._items
+        if centroids is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), items
+
+        found, scores = [], []
+        for cluster in top_k(centroids @ query, probes):
+            ids, vectors = self._cluster(cluster)
+            if ids is not None:
+                found.append(ids)
+                scores.append(vectors @ query)
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), items
+
+        found, scores = np.concatenate(found), np.concatenate(scores)
+        # Articles added after `alive` was taken are left for the next query
+        live = found < len(alive)
+        live[live] = alive[found[live]]
+        return found[live], scores[live], items
+
+    def search(self, queries, k=10, probes=8):
+        """Approximate top-k for each query row. Returns one [(item, score), ...] list per row, best first."""
+        queries = normalize(sp.csr_matrix(queries, dtype=np.float32))
+        results = []
+        for row in range(queries.shape[0]):
+            found, scores, items = self._probe(dense_row(queries, row), probes)
+            results.append([(items[found[i]], float(scores[i])) for i in top_k(scores, k)])
+        return results
+
+    def count_candidates(self, queries, probes=8):
+        """How many articles search() scores for each query row, for tuning clusters and probes"""
+        queries = normalize(sp.csr_matrix(queries, dtype=np.float32))
+        return [len(self._probe(dense_row(queries, row), probes)[0]) for row in range(queries.shape[0])]
@@ -0,0 +1,149 @@
+"""Recall and latency of the approximate article index against exact search.
+
+Builds a synthetic news corpus (stories reported by several outlets, grouped
+into topics, with a long tail of background words) and user profiles made the
+way the app makes them, from search queries and read articles. Every profile
+is then queried exactly (one sparse x dense product over all articles) and
+through the IVF index at several probe counts, reporting recall@k, articles
+scored and per-user latency.
+
+    python -m benchmarks.ann_benchmark
+    python -m benchmarks.ann_benchmark --articles 200000 --clusters 1024 --probes 4 8 16
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import clone
+
+from sklearn.preprocessing import normalize
+
+from article_index import ArticleIndex, dense_row, top_k
+from profile_store import ProfileStore
+from recommendation_model import RecommendationModel, apply_interaction, interaction_terms
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def make_corpus(num_articles, num_topics, rng):
+    """Synthetic articles as (topic, article dict); stories get 1-6 versions from different outlets"""
+    background = np.array([f"w{i}" for i in range(20000)])
+    # Zipf-distributed background words, sampled by inverting the cumulative distribution
+    zipf = np.cumsum(1 / np.arange(1, len(background) + 1))
+    zipf /= zipf[-1]
+    topics = [[f"t{topic}x{i}" for i in range(80)] for topic in range(num_topics)]
+
+    articles = []
+    while len(articles) < num_articles:
+        topic = int(rng.integers(num_topics))
+        story = list(rng.choice(topics[topic], 12, replace=False))
+        for _ in range(int(rng.integers(1, 7))):
+            words = lambda n: ' '.join(
+                rng.choice(story, n // 2).tolist()
+                + rng.choice(topics[topic], n // 4).tolist()
+                + background[np.searchsorted(zipf, rng.random(n - n // 2 - n // 4))].tolist()
+            )
+            articles.append((topic, {
+                'url': f"https://example.com/{len(articles)}",
+                'title': words(8),
+                'description': words(30)
+            }))
+    return articles[:num_articles], topics
+
+
+def make_profiles(model, articles, topics, num_users, rng):
+    """Profile vectors for users who each follow a couple of topics"""
+    by_topic = {}
+    for topic, article in articles:
+        by_topic.setdefault(topic, []).append(article)
+
+    vectors = []
+    for _ in range(num_users):
+        followed = rng.choice(list(by_topic), min(2, len(by_topic)), replace=False)
+        profile = None
+        for _ in range(20):
+            topic = followed[int(rng.integers(len(followed)))]
+            read = [by_topic[topic][i] for i in rng.integers(len(by_topic[topic]), size=2)]
+            profile = apply_interaction(profile, {
+                'terms': interaction_terms(' '.join(rng.choice(topics[topic], 2)), read),
+                'category': 'general'
+            })
+        vectors.append(model.profile_vector(model.preferences(profile)['terms']))
+    return sp.vstack(vectors, format='csr')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the approximate article index with exact search')
+    parser.add_argument('--articles', type=int, default=100000, help='Articles to index')
+    parser.add_argument('--topics', type=int, default=500, help='Topics the articles are spread over')
+    parser.add_argument('--users', type=int, default=200, help='User profiles to query')
+    parser.add_argument('-k', type=int, default=10, help='Recommendations per user')
+    parser.add_argument('--clusters', type=int, help='IVF clusters (default: 4 x sqrt(articles))')
+    parser.add_argument('--probes', type=int, nargs='+', default=[2, 4, 8, 16], help='Probe counts to try')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    model = RecommendationModel(profile_store=ProfileStore(
+        os.path.join(tempfile.mkdtemp(), 'profiles.db'), apply_interaction
+    ))
+    # The synthetic words aren't in any fitted vocabulary, so use the hashing vectorizer
+    model.vectorizer = clone(model.vectorizer)
+
+    articles, topics = make_corpus(args.articles, args.topics, rng)
+    started = time.perf_counter()
+    vectors = model.transform([f"{a['title']} {a['description']}" for _, a in articles])
+    print(f"{len(articles)} articles vectorized in {time.perf_counter() - started:.1f}s")
+
+    # Sized for the whole corpus, although only the first batch is there to learn clusters from
+    index = ArticleIndex(args.clusters or int(4 * np.sqrt(len(articles))), seed=args.seed)
+    started = time.perf_counter()
+    # The rest arrive in batches, as ingestion would
+    first = min(len(articles), index.sample_size)
+    index.add([a['url'] for _, a in articles[:first]], vectors[:first])
+    trained = time.perf_counter() - started
+    for start in range(first, len(articles), 1000):
+        index.add([a['url'] for _, a in articles[start:start + 1000]], vectors[start:start + 1000])
+    print(f"index built in {time.perf_counter() - started:.1f}s ({trained:.1f}s training {index.centroids.shape[0]} clusters)")
+
+    queries = make_profiles(model, articles, topics, args.users, rng)
+    print(f"{args.users} profiles, {queries.getnnz(axis=1).mean():.0f} terms on average\n")
+
+    vectors = normalize(vectors.astype(np.float32))
+    queries = normalize(queries.astype(np.float32))
+    urls = [a['url'] for _, a in articles]
+    # Warm up (and stack each cluster's batches) outside the timed runs
+    index.search(queries, args.k, max(args.probes))
+    vectors @ dense_row(queries, 0)
+
+    exact, exact_times = [], []
+    for row in range(queries.shape[0]):
+        started = time.perf_counter()
+        best = top_k(vectors @ dense_row(queries, row), args.k)
+        exact_times.append(time.perf_counter() - started)
+        exact.append({urls[i] for i in best})
+
+    print(f"{'search':14} {'recall@' + str(args.k):>9} {'scored':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    print(f"{'exact':14} {1:9.3f} {len(articles):11} {percentile(exact_times, 50) * 1000:8.2f} "
+          f"{percentile(exact_times, 99) * 1000:8.2f}")
+
+    for probes in args.probes:
+        recalls, times = [], []
+        for row in range(queries.shape[0]):
+            started = time.perf_counter()
+            found = {url for url, _ in index.search(queries[row], args.k, probes)[0]}
+            times.append(time.perf_counter() - started)
+            recalls.append(len(found & exact[row]) / len(exact[row]))
+        candidates = index.count_candidates(queries, probes)
+        print(f"{'ivf probes=' + str(probes):14} {np.mean(recalls):9.3f} {np.mean(candidates):11.0f} "
+              f"{percentile(times, 50) * 1000:8.2f} {percentile(times, 99) * 1000:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
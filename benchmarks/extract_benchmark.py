@@ -0,0 +1,129 @@
+"""Offline throughput benchmark for reader-mode extraction.
+
+Runs the extraction both reader routes share over the saved publisher pages
+in benchmarks/corpus, without touching the network, and reports pages/sec,
+p50/p99 per-page time, peak memory and the paragraph/image counts for each
+page. Counts are checked against benchmarks/corpus/expected.json so a speedup
+that changes the output shows up as a mismatch (exit status 1).
+
+The bundled pages are synthetic, modelled on common publisher layouts (test
+ids, article/main containers, WordPress, table soup, paywall teasers, a long
+read with comments) so they can be shipped without third-party content. Add
+real pages with `python -m benchmarks.parse_benchmark --save URL`.
+
+    python -m benchmarks.extract_benchmark
+    python -m benchmarks.extract_benchmark --repeat 20 --parser lxml --rules
+    python -m benchmarks.extract_benchmark --update-expected
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from benchmarks.parse_benchmark import load_corpus
+from cache import TTLCache
+from reader import SelectorRules, extract_article, resolve_parser, text_blocks
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+
+def counts(extracted):
+    """What each route would show: /read_article's text blocks and the page's images"""
+    paragraphs = text_blocks(extracted['blocks'])
+    return {
+        'paragraphs': len(paragraphs),
+        'images': len(extracted['blocks']) - len(paragraphs),
+        'found_main': extracted['found_main']
+    }
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(pages, parser, repeat, rules):
+    """Extract every page `repeat` times. Returns ({path: [seconds]}, {path: counts})."""
+    timings = {path: [] for path, _, _ in pages}
+    results = {}
+    for _ in range(repeat):
+        for path, url, html in pages:
+            started = time.perf_counter()
+            extracted = extract_article(html, url, parser, rules)
+            timings[path].append(time.perf_counter() - started)
+            results[path] = counts(extracted)
+    return timings, results
+
+
+def peak_memory(pages, parser, rules):
+    """Peak traced allocation for extracting a single page, in bytes"""
+    peak = 0
+    for path, url, html in pages:
+        tracemalloc.start()
+        extract_article(html, url, parser, rules)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reader-mode extraction on a saved corpus')
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='Directory of saved .html pages')
+    parser.add_argument('--repeat', type=int, default=10, help='Times to extract each page')
+    parser.add_argument('--parser', help='HTML parser backend (default: fastest installed)')
+    parser.add_argument('--rules', action='store_true', help='Learn per-domain selectors as the app does')
+    parser.add_argument('--update-expected', action='store_true', help='Save the current counts as expected')
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        parser.error(f"No .html pages found in {args.corpus}")
+    backend = resolve_parser(args.parser)
+    rules = SelectorRules(TTLCache()) if args.rules else None
+
+    # Warm up imports and compiled selectors outside the timed runs
+    run(pages, backend, 1, rules)
+    timings, results = run(pages, backend, args.repeat, rules)
+    peak = peak_memory(pages, backend, rules)
+
+    expected_path = os.path.join(args.corpus, 'expected.json')
+    expected = {}
+    if os.path.exists(expected_path):
+        with open(expected_path, encoding='utf-8') as f:
+            expected = json.load(f)
+
+    mismatches = 0
+    print(f"{'page':38} {'KB':>5} {'p50 ms':>8} {'paras':>6} {'imgs':>5} {'main':>5}  check")
+    for path, _, html in pages:
+        name = os.path.basename(path)
+        result = results[path]
+        check = '-'
+        if name in expected:
+            check = 'ok' if expected[name] == result else 'MISMATCH'
+            mismatches += check == 'MISMATCH'
+        print(f"{name:38} {len(html) // 1024:5} {percentile(timings[path], 50) * 1000:8.2f} "
+              f"{result['paragraphs']:6} {result['images']:5} {str(result['found_main']):>5}  {check}")
+        if check == 'MISMATCH':
+            print(f"{'':38} expected {expected[name]}")
+
+    all_timings = [t for page_timings in timings.values() for t in page_timings]
+    print(f"\n{len(pages)} pages x {args.repeat}, parser {backend}{', learned selectors' if rules else ''}")
+    print(f"throughput  {len(all_timings) / sum(all_timings):8.1f} pages/sec")
+    print(f"p50         {percentile(all_timings, 50) * 1000:8.2f} ms/page")
+    print(f"p99         {percentile(all_timings, 99) * 1000:8.2f} ms/page")
+    print(f"peak memory {peak / 1024 / 1024:8.2f} MB (largest single page, tracemalloc)")
+
+    if args.update_expected:
+        with open(expected_path, 'w', encoding='utf-8') as f:
+            json.dump({os.path.basename(path): results[path] for path, _, _ in pages}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved expected counts to {expected_path}")
+    elif mismatches:
+        print(f"{mismatches} page(s) extracted differently than expected")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
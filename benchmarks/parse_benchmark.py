@@ -0,0 +1,89 @@
+"""Compare reader-mode parse throughput across HTML parser backends.
+
+Extracts every saved page in a corpus directory with each installed backend,
+reports pages/sec per backend and checks that every backend extracts the
+same paragraphs and images as html.parser.
+
+    python -m benchmarks.parse_benchmark
+    python -m benchmarks.parse_benchmark pages/ --repeat 5 --save https://example.com/story
+"""
+import argparse
+import glob
+import os
+import time
+
+from bs4.builder import builder_registry
+
+import outbound
+from reader import HEADERS, PARSER_BACKENDS, extract_article
+
+
+def save_pages(urls, corpus_dir):
+    """Download pages into the corpus so later runs don't need the network"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    for index, url in enumerate(urls):
+        response = outbound.get(url, headers=HEADERS)
+        path = os.path.join(corpus_dir, f"saved-{int(time.time())}-{index}.html")
+        with open(path, 'w', encoding='utf-8') as f:
+            # Keep the source URL so relative image links resolve the same way
+            f.write(f"<!-- url: {url} -->\n{response.text}")
+        print(f"Saved {url} -> {path}")
+
+
+def load_corpus(corpus_dir):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.html'))):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            html = f.read()
+        url = 'https://example.com/' + os.path.basename(path)
+        if html.startswith('<!-- url: '):
+            url = html[len('<!-- url: '):html.index(' -->')]
+        pages.append((path, url, html))
+    return pages
+
+
+def run(pages, backends, repeat):
+    baseline = {}
+    for backend in backends:
+        mismatches = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for path, url, html in pages:
+                result = extract_article(html, url, backend)
+                if backend == 'html.parser':
+                    baseline[path] = result
+                elif baseline.get(path, result) != result:
+                    mismatches.append(path)
+        elapsed = time.perf_counter() - started
+        print(f"{backend:12} {len(pages) * repeat / elapsed:8.1f} pages/sec "
+              f"({elapsed * 1000 / (len(pages) * repeat):.2f} ms/page)")
+        for path in sorted(set(mismatches)):
+            print(f"  output differs from html.parser: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reader-mode HTML parser backends')
+    parser.add_argument('corpus', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus'),
+                        help='Directory of saved .html pages (default: benchmarks/corpus)')
+    parser.add_argument('--repeat', type=int, default=3, help='Times to parse the corpus per backend')
+    parser.add_argument('--save', nargs='+', metavar='URL', help='Fetch these pages into the corpus first')
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.save, args.corpus)
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        parser.error(f"No .html pages found in {args.corpus}")
+
+    # html.parser always runs first since it is the reference output
+    backends = ['html.parser'] + [name for name in PARSER_BACKENDS
+                                  if name != 'html.parser' and builder_registry.lookup(name)]
+    missing = set(PARSER_BACKENDS) - set(backends)
+    print(f"{len(pages)} pages, backends: {', '.join(backends)}"
+          + (f" (not installed: {', '.join(sorted(missing))})" if missing else ''))
+    run(pages, backends, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
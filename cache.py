@@ -0,0 +1,305 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+FRESH = 'fresh'
+STALE = 'stale'
+EXPIRED = 'expired'
+
+
+def _state(now, expires_at, stale_ttl, include_expired):
+    if now < expires_at:
+        return FRESH
+    if now < expires_at + stale_ttl:
+        return STALE
+    return EXPIRED if include_expired else None
+
+
+class TTLCache:
+    """Thread-safe in-memory cache with per-entry TTL and LRU eviction.
+
+    Entries are fresh for ``ttl`` seconds and then kept for another
+    ``stale_ttl`` seconds so callers can serve them while revalidating.
+    """
+
+    def __init__(self, max_entries=256, ttl=300, stale_ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, include_expired=False):
+        """Return (value, state) for a key, or None if it is missing or expired.
+
+        Expired entries stay around until LRU eviction so that callers who
+        can't fetch a new copy may still ask for them with ``include_expired``.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            state = _state(time.monotonic(), expires_at, self.stale_ttl, include_expired)
+            if state is None:
+                return None
+            self._entries.move_to_end(key)
+            return value, state
+
+    def get(self, key, default=None):
+        """Return a fresh value for a key, ignoring stale entries"""
+        entry = self.lookup(key)
+        if entry is None or entry[1] != FRESH:
+            return default
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            # Evict least recently used entries beyond the size bound
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """SQLite-backed cache shared by every worker process on a host.
+
+    Values must be JSON serializable. Entries follow the same fresh/stale/
+    expired lifecycle as TTLCache, but use wall-clock time so they survive
+    restarts, and the least recently used entries are evicted once the
+    namespace grows past ``max_bytes``.
+    """
+
+    # Only rewrite an entry's access time when it is older than this, to keep hits read-only
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path, namespace='default', max_bytes=64 * 1024 * 1024, ttl=300, stale_ttl=0):
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')  # Readers don't block the writer
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache_entries ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'expires_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (namespace, accessed_at)')
+
+    def _connect(self):
+        # One connection per thread and process; sqlite connections can't be shared across either
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _key(self, key):
+        return key if isinstance(key, str) else json.dumps(key)
+
+    def entry(self, key):
+        """Return (value, expires_at) for a key regardless of age, or None"""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT value, expires_at, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?',
+                (self.namespace, self._key(key))
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[2] > self.TOUCH_INTERVAL:
+                conn.execute(
+                    'UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                    (now, self.namespace, self._key(key))
+                )
+            return json.loads(row[0]), row[1]
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Error reading disk cache: {e}")
+            return None
+
+    def lookup(self, key, include_expired=False):
+        """Return (value, state) for a key, or None if it is missing or expired"""
+        entry = self.entry(key)
+        if entry is None:
+            return None
+        state = _state(time.time(), entry[1], self.stale_ttl, include_expired)
+        return None if state is None else (entry[0], state)
+
+    def get(self, key, default=None):
+        entry = self.lookup(key)
+        if entry is None or entry[1] != FRESH:
+            return default
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        data = json.dumps(value)
+        try:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.namespace, self._key(key), data, len(data), now + (self.ttl if ttl is None else ttl), now)
+            )
+            self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Error writing disk cache: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until we're back under 90% of the limit
+        excess = total - int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in conn.execute(
+            'SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed_at', (self.namespace,)
+        ):
+            doomed.append((self.namespace, key))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', doomed)
+
+    def delete(self, key):
+        try:
+            self._connect().execute(
+                'DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (self.namespace, self._key(key))
+            )
+        except sqlite3.Error as e:
+            print(f"Error writing disk cache: {e}")
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache_entries WHERE namespace = ?', (self.namespace,))
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+
+
+class TieredCache:
+    """In-process TTLCache in front of a DiskCache shared with the other workers.
+
+    Writes go to both tiers. A miss or stale hit in memory checks the disk,
+    where another worker may already have stored a fresher copy.
+    """
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+
+    def lookup(self, key, include_expired=False):
+        local = self.memory.lookup(key, include_expired=include_expired)
+        if local is not None and local[1] == FRESH:
+            return local
+
+        shared = self.disk.entry(key)
+        if shared is not None:
+            value, expires_at = shared
+            remaining = expires_at - time.time()
+            if remaining > 0:
+                # Promote into memory for the rest of its lifetime
+                self.memory.set(key, value, ttl=remaining)
+                return value, FRESH
+            state = _state(time.time(), expires_at, self.disk.stale_ttl, include_expired)
+            if local is None and state is not None:
+                return value, state
+        return local
+
+    def get(self, key, default=None):
+        entry = self.lookup(key)
+        if entry is None or entry[1] != FRESH:
+            return default
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl=ttl)
+        self.disk.set(key, value, ttl=ttl)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def __len__(self):
+        return len(self.disk)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution.
+
+    The first caller for a key runs the function; everyone arriving while it
+    is in flight waits and receives the same result (or exception).
+    `wait_timeout`, if given, is called by each waiting caller for the
+    seconds it may wait (None for no limit); TimeoutError is raised past that.
+    """
+
+    def __init__(self, wait_timeout=None):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.wait_timeout = wait_timeout
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            timeout = self.wait_timeout() if self.wait_timeout else None
+            if not call.done.wait(None if timeout is None else max(0, timeout)):
+                raise TimeoutError(f"Gave up waiting for the call already in flight for {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,143 @@
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, ManagedArticle, NewsSource
+from news_api import NewsAPIError
+
+# NewsAPI top-headlines categories pulled on every ingestion run
+CATEGORIES = ['general', 'business', 'entertainment', 'health', 'science', 'sports', 'technology']
+
+# Columns refreshed when an already-ingested URL is seen again; moderation fields are left alone
+UPSERT_COLUMNS = ['title', 'description', 'image_url', 'source_name', 'source_id',
+                  'category', 'published_at', 'ingested_at']
+
+UPSERT_BATCH_SIZE = 100
+
+
+def parse_published_at(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+    except (TypeError, ValueError):
+        return None
+
+
+def find_source_ids():
+    """Map known NewsSource domains and names to their ids"""
+    source_ids = {}
+    for source in NewsSource.query.filter_by(is_active=True).all():
+        domain = urlparse(source.url).netloc.lower()
+        if domain:
+            source_ids[domain.removeprefix('www.')] = source.id
+        source_ids[source.name.lower()] = source.id
+    return source_ids
+
+
+def to_row(article, category, source_ids, ingested_at):
+    """Convert a NewsAPI article into a ManagedArticle row, or None if unusable"""
+    url = article.get('url')
+    title = article.get('title')
+    if not url or not title or len(url) > 500:
+        return None
+
+    source_name = (article.get('source') or {}).get('name')
+    domain = urlparse(url).netloc.lower().removeprefix('www.')
+    return {
+        'title': title[:500],
+        'url': url,
+        'description': article.get('description'),
+        'image_url': (article.get('urlToImage') or '')[:1000] or None,
+        'source_name': source_name[:100] if source_name else None,
+        'source_id': source_ids.get(domain) or source_ids.get((source_name or '').lower()),
+        'category': category,
+        'published_at': parse_published_at(article.get('publishedAt')) or ingested_at,
+        'ingested_at': ingested_at
+    }
+
+
+def upsert_articles(rows):
+    """Bulk insert rows into ManagedArticle, updating existing rows by url"""
+    insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        stmt = insert(ManagedArticle).values(rows[start:start + UPSERT_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['url'],
+            set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS}
+        )
+        db.session.execute(stmt)
+    db.session.commit()
+
+
+def ingest_headlines(news_api, categories=CATEGORIES, page_size=100):
+    """Pull top headlines for each category and upsert them. Returns the row count."""
+    ingested_at = datetime.utcnow()
+    source_ids = find_source_ids()
+    rows = {}
+
+    for category in categories:
+        try:
+            # Go straight to the API; the in-process response cache is for request handlers.
+            # Never critical: the quota reserve is kept for user-facing searches.
+            params = news_api.build_params(page_size=page_size, category=category)
+            articles = news_api.get('top-headlines', params, route='ingest_news', critical=False).get('articles', [])
+        except NewsAPIError as e:
+            print(f"Error ingesting {category} headlines: {e}")
+            continue
+
+        for article in articles:
+            row = to_row(article, category, source_ids, ingested_at)
+            # The same story can be listed under several categories; keep the first
+            if row and row['url'] not in rows:
+                rows[row['url']] = row
+
+    if rows:
+        upsert_articles(list(rows.values()))
+        NewsSource.query.filter(NewsSource.id.in_(
+            {row['source_id'] for row in rows.values() if row['source_id']}
+        )).update({'last_fetched': ingested_at}, synchronize_session=False)
+        db.session.commit()
+    return len(rows)
+
+
+def run_ingestion_loop(app, news_api, interval, categories=CATEGORIES):
+    """Ingest headlines every `interval` seconds until interrupted"""
+    while True:
+        started = time.monotonic()
+        with app.app_context():
+            try:
+                count = ingest_headlines(news_api, categories)
+                print(f"Ingested {count} articles")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error during ingestion: {e}")
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+def to_api_article(article):
+    """Convert a ManagedArticle back into the NewsAPI article shape the templates expect"""
+    return {
+        'source': {'id': None, 'name': article.source_name},
+        'title': article.title,
+        'description': article.description,
+        'url': article.url,
+        'urlToImage': article.image_url,
+        'publishedAt': article.published_at.strftime('%Y-%m-%dT%H:%M:%SZ') if article.published_at else None,
+        'category': article.category
+    }
+
+
+def recent_headlines(max_age, limit, category=None):
+    """Return recently ingested headlines, or None if ingestion hasn't run recently"""
+    query = ManagedArticle.query.filter(
+        ManagedArticle.ingested_at >= datetime.utcnow() - timedelta(seconds=max_age)
+    )
+    if category:
+        query = query.filter(ManagedArticle.category == category)
+
+    articles = query.order_by(ManagedArticle.published_at.desc()).limit(limit).all()
+    if not articles:
+        return None
+    return [to_api_article(article) for article in articles]
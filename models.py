@@ -83,9 +83,13 @@ class ManagedArticle(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(500), nullable=False)
     url = db.Column(db.String(500), nullable=False, unique=True)
+    description = db.Column(db.Text, nullable=True)
+    image_url = db.Column(db.String(1000), nullable=True)
+    source_name = db.Column(db.String(100), nullable=True)  # Publisher name as reported by NewsAPI
     source_id = db.Column(db.Integer, db.ForeignKey('news_source.id'))
     category = db.Column(db.String(50))
     published_at = db.Column(db.DateTime, default=datetime.utcnow)
+    ingested_at = db.Column(db.DateTime, nullable=True, index=True)  # Last time the ingestion worker saw this article
     is_approved = db.Column(db.Boolean, default=False)
     approved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     approved_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,192 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import outbound
+from cache import TTLCache, SingleFlight, FRESH
+
+NEWS_API_BASE_URL = 'https://newsapi.org/v2'
+
+# Client modes: 'live' calls the API, 'record' also saves every response to the
+# cassette directory, and 'replay' serves only from previously saved responses
+LIVE = 'live'
+RECORD = 'record'
+REPLAY = 'replay'
+
+
+def request_key(endpoint, params):
+    """Normalize an endpoint and parameter set into a hashable key (API key excluded)"""
+    return (endpoint,) + tuple(sorted(
+        (key, str(value).strip().lower()) for key, value in params.items() if key != 'apiKey'
+    ))
+
+
+def cassette_filename(endpoint, params):
+    """Stable file name for a recorded response"""
+    digest = hashlib.sha1(repr(request_key(endpoint, params)).encode('utf-8')).hexdigest()
+    return f"{endpoint}-{digest[:16]}.json"
+
+
+class NewsAPIError(Exception):
+    """Raised when a NewsAPI call fails or returns a non-OK response"""
+
+
+class QuotaExceededError(NewsAPIError):
+    """Raised when the quota limiter refuses an upstream call"""
+
+
+class NewsAPIClient:
+    def __init__(self, api_key, base_url=NEWS_API_BASE_URL, connect_timeout=3.05,
+                 read_timeout=10, pool_size=10, cache=None, mode=LIVE, cassette_dir=None,
+                 limiter=None):
+        if mode not in (LIVE, RECORD, REPLAY):
+            raise ValueError(f"Unknown NewsAPI client mode: {mode}")
+        if mode != LIVE and not cassette_dir:
+            raise ValueError(f"NewsAPI {mode} mode needs a cassette directory")
+
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+        # Optional rate_limit.QuotaLimiter consulted before every live call
+        self.limiter = limiter
+        # Headline responses are served from here; stale entries are refreshed in the background
+        self.cache = cache if cache is not None else TTLCache()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='newsapi-refresh')
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        # At most one upstream call per normalized request key at any time
+        self._flight = SingleFlight()
+
+        # One pooled session so keep-alive connections are reused across requests
+        self.session = outbound.create_session(pool_size)
+
+    def build_params(self, page_size=None, category=None, q=None, country=None, language='en'):
+        """Build the query parameters for a NewsAPI call, dropping empty values"""
+        params = {
+            'apiKey': self.api_key,
+            'language': language,
+            'pageSize': page_size,
+            'category': category,
+            'q': q,
+            'country': country
+        }
+        return {key: value for key, value in params.items() if value}
+
+    def get(self, endpoint, params, route=None, critical=True):
+        """Call a NewsAPI endpoint and return the decoded JSON body"""
+        if self.mode == REPLAY:
+            return self._replay(endpoint, params)
+
+        if self.limiter and not self.limiter.acquire(route, critical=critical):
+            raise QuotaExceededError(f"NewsAPI quota exhausted for {route or endpoint}")
+
+        try:
+            # Goes through the per-host circuit breaker and the current request's deadline
+            response = outbound.get(f"{self.base_url}/{endpoint}", session=self.session,
+                                    timeout=self.timeout, params=params)
+        except requests.RequestException as e:
+            raise NewsAPIError(f"Request to {endpoint} failed: {e}") from e
+
+        if not response.ok:
+            raise NewsAPIError(f"{endpoint} returned HTTP {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError as e:
+            # e.g. a proxy's HTML error page served with a 200
+            raise NewsAPIError(f"{endpoint} returned a body that isn't JSON") from e
+
+        if self.mode == RECORD:
+            self._record(endpoint, params, data)
+        return data
+
+    def _record(self, endpoint, params, data):
+        os.makedirs(self.cassette_dir, exist_ok=True)
+        path = os.path.join(self.cassette_dir, cassette_filename(endpoint, params))
+        # Write to a temp file first so a concurrent replay never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'request': dict(request_key(endpoint, params)[1:]), 'response': data}, f)
+        os.replace(tmp_path, path)
+
+    def _replay(self, endpoint, params):
+        path = os.path.join(self.cassette_dir, cassette_filename(endpoint, params))
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)['response']
+        except (OSError, ValueError, KeyError) as e:
+            raise NewsAPIError(f"No recorded {endpoint} response for {dict(request_key(endpoint, params)[1:])}") from e
+
+    def cached_get(self, endpoint, params, route=None, critical=True):
+        """Serve a call from the cache, revalidating stale entries in the background"""
+        key = request_key(endpoint, params)
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            data, state = entry
+            if state != FRESH:
+                self._refresh_in_background(key, endpoint, params, route)
+            return data
+
+        try:
+            return self._flight.do(key, self._fetch_and_store, key, endpoint, params, route, critical)
+        except QuotaExceededError:
+            # Out of budget: an expired response beats no response
+            entry = self.cache.lookup(key, include_expired=True)
+            if entry is None:
+                raise
+            print(f"NewsAPI quota low, serving expired {endpoint} response for {route or endpoint}")
+            return entry[0]
+
+    def _fetch_and_store(self, key, endpoint, params, route=None, critical=True, revalidate=False):
+        # Another flight may have filled the cache between our lookup and now
+        if not revalidate:
+            entry = self.cache.lookup(key)
+            if entry is not None and entry[1] == FRESH:
+                return entry[0]
+        data = self.get(endpoint, params, route=route, critical=critical)
+        self.cache.set(key, data)
+        return data
+
+    def _refresh_in_background(self, key, endpoint, params, route):
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._refresher.submit(self._refresh, key, endpoint, params, route)
+
+    def _refresh(self, key, endpoint, params, route):
+        try:
+            # Revalidation is never critical; callers already have a stale copy to show
+            self._flight.do(key, self._fetch_and_store, key, endpoint, params, route,
+                            critical=False, revalidate=True)
+        except NewsAPIError as e:
+            print(f"Error refreshing cached {endpoint}: {e}")
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+
+    def cached_headlines(self, page_size=None, category=None, q=None, country=None, language='en'):
+        """Return whatever top headlines are cached for these parameters, without calling the API"""
+        params = self.build_params(page_size=page_size, category=category, q=q,
+                                   country=country, language=language)
+        entry = self.cache.lookup(request_key('top-headlines', params), include_expired=True)
+        return copy.deepcopy(entry[0].get('articles', [])) if entry else []
+
+    def top_headlines(self, page_size=None, category=None, q=None, country=None, language='en',
+                      route=None, critical=True):
+        """Fetch top headlines and return the list of articles.
+
+        ``route`` selects the per-route quota budget; non-critical callers are
+        served cached data instead once the daily quota runs low.
+        """
+        params = self.build_params(page_size=page_size, category=category, q=q,
+                                   country=country, language=language)
+        articles = self.cached_get('top-headlines', params, route=route, critical=critical).get('articles', [])
+        # Callers annotate articles in place, so never hand out the cached objects
+        return copy.deepcopy(articles)
@@ -0,0 +1,124 @@
+"""Local stand-in for the NewsAPI endpoints used by the app.
+
+Serves /v2/top-headlines from responses recorded with NEWS_API_MODE=record,
+or from deterministic synthetic articles, with configurable latency and
+error injection. Synthetic article URLs point back at this server, which
+also serves matching article pages and images, so reader mode can be
+benchmarked without network access too.
+
+    python newsapi_standin.py --port 5001 --latency 0.2 --error-rate 0.05
+    NEWS_API_BASE_URL=http://127.0.0.1:5001/v2 flask run
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from flask import Flask, Response, abort, jsonify, request
+
+from news_api import cassette_filename
+
+CATEGORIES = ['general', 'business', 'entertainment', 'health', 'science', 'sports', 'technology']
+SOURCES = ['Standin Times', 'Offline Herald', 'Loopback Post', 'Localhost Ledger']
+WORDS = ('market election team season study launch policy record growth city storm court '
+         'vaccine league startup climate budget research player company festival report').split()
+
+# Smallest valid GIF padded past the 1KB size check reader mode applies to images
+IMAGE_BYTES = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,' \
+              b'\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;' + b'\x00' * 2048
+
+app = Flask(__name__)
+app.config.update(LATENCY=0.0, JITTER=0.0, ERROR_RATE=0.0, CASSETTE_DIR=None, SEED=0)
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize()
+
+
+def synthetic_article(category, index):
+    """Build the same article every time for a given category and index"""
+    rng = random.Random(f"{app.config['SEED']}-{category}-{index}")
+    published = time.gmtime(time.time() - rng.randint(0, 72) * 3600)
+    return {
+        'source': {'id': None, 'name': rng.choice(SOURCES)},
+        'author': None,
+        'title': f"{sentence(rng, 8)} ({category} #{index})",
+        'description': sentence(rng, 20) + '.',
+        'url': f"{request.host_url}articles/{category}/{index}",
+        'urlToImage': f"{request.host_url}images/{category}-{index}.gif",
+        'publishedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', published),
+        'content': sentence(rng, 30) + '.'
+    }
+
+
+def inject_faults():
+    """Sleep for the configured latency and maybe fail like an overloaded upstream"""
+    delay = app.config['LATENCY'] + random.uniform(0, app.config['JITTER'])
+    if delay:
+        time.sleep(delay)
+    if random.random() < app.config['ERROR_RATE']:
+        abort(random.choice([429, 500, 503]))
+
+
+@app.route('/v2/top-headlines')
+def top_headlines():
+    inject_faults()
+
+    params = request.args.to_dict()
+    if app.config['CASSETTE_DIR']:
+        path = os.path.join(app.config['CASSETTE_DIR'], cassette_filename('top-headlines', params))
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return jsonify(json.load(f)['response'])
+
+    category = params.get('category', 'general')
+    page_size = min(int(params.get('pageSize', 20)), 100)
+    articles = [synthetic_article(category, index) for index in range(page_size)]
+    if params.get('q'):
+        articles = [a for a in articles if params['q'].lower() in a['title'].lower()]
+    return jsonify({'status': 'ok', 'totalResults': len(articles), 'articles': articles})
+
+
+@app.route('/articles/<category>/<int:index>')
+def article_page(category, index):
+    inject_faults()
+
+    rng = random.Random(f"{app.config['SEED']}-page-{category}-{index}")
+    paragraphs = ''.join(f"<p>{sentence(rng, rng.randint(25, 60))}.</p>" for _ in range(rng.randint(8, 20)))
+    figures = ''.join(
+        f'<figure><img src="/images/{category}-{index}-{n}.gif" alt="Figure {n}">'
+        f'<figcaption>{sentence(rng, 6)}</figcaption></figure>'
+        for n in range(rng.randint(1, 4))
+    )
+    html = (
+        f"<html><head><title>{category} #{index}</title><script>var tracking = 1;</script></head>"
+        f"<body><nav><a href='/'>Home</a></nav><article><h1>{sentence(rng, 8)}</h1>"
+        f"{figures}{paragraphs}</article><footer><p>Standin footer</p></footer></body></html>"
+    )
+    # Pages never change, so conditional requests from reader mode's revalidation get a 304
+    response = Response(html, mimetype='text/html')
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/images/<name>')
+def image(name):
+    inject_faults()
+    return Response(IMAGE_BYTES, mimetype='image/gif')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline NewsAPI stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random seconds, up to this much')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail (0-1)')
+    parser.add_argument('--cassettes', help='Serve responses recorded with NEWS_API_MODE=record from here')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic articles')
+    args = parser.parse_args()
+
+    app.config.update(LATENCY=args.latency, JITTER=args.jitter, ERROR_RATE=args.error_rate,
+                      CASSETTE_DIR=args.cassettes, SEED=args.seed)
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,201 @@
+import contextvars
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Timeout used for outbound calls that don't ask for a specific one
+DEFAULT_TIMEOUT = (3.05, 10)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling a host whose circuit breaker is open"""
+
+
+class DeadlineExceededError(requests.RequestException):
+    """Raised when the current request has no time left for another outbound call"""
+
+
+class ResponseTooLargeError(requests.RequestException):
+    """Raised when a streamed response body is bigger than the caller allows"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing.
+
+    After ``failure_threshold`` failures in a row the circuit opens and calls
+    fail fast. Once ``recovery_timeout`` seconds have passed a single probe is
+    let through; its outcome closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """Give back a half-open probe slot without recording an outcome"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class BreakerRegistry:
+    """One circuit breaker per upstream host"""
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.recovery_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+    def states(self):
+        with self._lock:
+            return {host: breaker.state for host, breaker in self._breakers.items()}
+
+
+breakers = BreakerRegistry()
+
+# Monotonic time by which the current request must be finished, or None
+_deadline = contextvars.ContextVar('outbound_deadline', default=None)
+
+
+def start_deadline(seconds):
+    """Give the current request `seconds` of total outbound time. Returns a reset token."""
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def clear_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left in the current request's budget, or None if it has no deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def clamp_timeout(timeout):
+    """Shrink a (connect, read) timeout so it fits inside the current deadline"""
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceededError('Request deadline exceeded before outbound call')
+    connect, read = timeout
+    return (min(connect, remaining), min(read, remaining))
+
+
+def create_session(pool_size=10):
+    """Create a requests session with a keep-alive connection pool"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared session for publisher pages, images and source health checks
+session = create_session(pool_size=20)
+
+
+def request(method, url, session=session, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """Make an outbound HTTP call through the host's circuit breaker and the request deadline.
+
+    5xx and 429 responses count as failures for the breaker but are still
+    returned to the caller; connection errors and timeouts are re-raised.
+    """
+    timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    clamped = clamp_timeout(timeout)
+    host = urlparse(url).netloc.lower()
+    breaker = breakers.get(host)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {host}")
+
+    try:
+        response = session.request(method, url, timeout=clamped, **kwargs)
+    except requests.Timeout:
+        # A timeout we shortened to fit our own deadline says nothing about the host
+        if clamped != timeout:
+            breaker.release()
+        else:
+            breaker.record_failure()
+        raise
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def read_limited(response, max_bytes, chunk_size=65536):
+    """Read a response made with stream=True, giving up past `max_bytes` or the request deadline"""
+    declared = response.headers.get('content-length', '')
+    if declared.isdigit() and int(declared) > max_bytes:
+        raise ResponseTooLargeError(f"Response is {declared} bytes, limit is {max_bytes}")
+
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size):
+        body += chunk
+        if len(body) > max_bytes:
+            raise ResponseTooLargeError(f"Response is over the {max_bytes} byte limit")
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError('Request deadline exceeded while reading response')
+    return bytes(body)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    return request('HEAD', url, **kwargs)
@@ -0,0 +1,209 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from sqlite_helpers import connect, write_transaction
+
+
+class ProfileStore:
+    """Per-user recommendation profiles in a keyed SQLite table, written behind in batches.
+
+    Updates are queued in memory and applied by a background thread every
+    ``flush_interval`` seconds (or sooner once ``max_pending`` pile up). A flush
+    only touches the users that changed, and runs as one BEGIN IMMEDIATE
+    transaction that re-reads each stored profile and replays the queued
+    updates onto it with ``apply(profile, update)``. So gunicorn workers
+    sharing the file never overwrite each other's updates, and a crash leaves
+    either the old profiles or the new ones. Reads see this worker's queued
+    updates straight away.
+    """
+
+    def __init__(self, path, apply, flush_interval=2.0, max_pending=500):
+        self.path = path
+        self.apply = apply
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = defaultdict(list)
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS user_profiles '
+                '(user_id TEXT PRIMARY KEY, profile TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+        finally:
+            conn.close()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _load(self, conn, user_id):
+        row = conn.execute('SELECT profile FROM user_profiles WHERE user_id = ?', (str(user_id),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get(self, user_id):
+        """Return a user's profile including updates not yet flushed, or None if there is none"""
+        conn = self._connect()
+        try:
+            profile = self._load(conn, user_id)
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Error reading user profile: {e}")
+            profile = None
+        finally:
+            conn.close()
+
+        with self._lock:
+            updates = list(self._pending.get(str(user_id), []))
+        for update in updates:
+            profile = self.apply(profile, update)
+        return profile
+
+    def get_many(self, user_ids):
+        """Like get() for many users with one query per 500 users. Returns {user_id: profile}."""
+        user_ids = [str(user_id) for user_id in user_ids]
+        stored = {}
+        conn = self._connect()
+        try:
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                for user_id, profile in conn.execute(
+                    f"SELECT user_id, profile FROM user_profiles WHERE user_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ):
+                    try:
+                        stored[user_id] = json.loads(profile)
+                    except ValueError as e:
+                        print(f"Error reading profile for user {user_id}: {e}")
+        except sqlite3.Error as e:
+            print(f"Error reading user profiles: {e}")
+        finally:
+            conn.close()
+
+        with self._lock:
+            pending = {user_id: list(self._pending[user_id]) for user_id in user_ids if user_id in self._pending}
+        for user_id, updates in pending.items():
+            for update in updates:
+                stored[user_id] = self.apply(stored.get(user_id), update)
+        return stored
+
+    def user_ids(self, updated_since=None):
+        """Ids of users with a stored profile, optionally only those updated since a unix time"""
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute(
+                'SELECT user_id FROM user_profiles WHERE updated_at >= ?', (updated_since or 0,)
+            )]
+        finally:
+            conn.close()
+
+    def update(self, user_id, update):
+        """Queue an update for a user; it is persisted by the next flush"""
+        self._ensure_writer()
+        with self._lock:
+            self._pending[str(user_id)].append(update)
+            self._pending_count += 1
+            if self._pending_count >= self.max_pending:
+                self._wakeup.set()
+
+    def _ensure_writer(self):
+        # Started lazily and per process, since threads don't survive a gunicorn fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending.clear()
+                self._pending_count = 0
+                threading.Thread(target=self._write_behind, name='profile-writer', daemon=True).start()
+
+    def _write_behind(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # flush() has already put the batch back if it failed to write; keep the thread alive
+                print(f"Error in profile writer: {e}")
+
+    def flush(self):
+        """Persist every queued update. Returns the number of users written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(list)
+                self._pending_count = 0
+            if not pending:
+                return 0
+
+            now = time.time()
+            conn = self._connect()
+            try:
+                # Another worker's flush for the same user can't land between our read and write
+                with write_transaction(conn):
+                    rows = []
+                    for user_id, updates in pending.items():
+                        try:
+                            profile = self._load(conn, user_id)
+                        except ValueError as e:
+                            # Retrying can't repair a corrupt row, so start the profile over
+                            print(f"Discarding unreadable profile for user {user_id}: {e}")
+                            profile = None
+                        for update in updates:
+                            try:
+                                profile = self.apply(profile, update)
+                            except Exception as e:
+                                # It would fail the same way next time, so it is dropped rather than retried
+                                print(f"Dropping bad profile update for user {user_id}: {e}")
+                        rows.append((user_id, json.dumps(profile, default=str), now))
+                    conn.executemany(
+                        'INSERT INTO user_profiles (user_id, profile, updated_at) VALUES (?, ?, ?) '
+                        'ON CONFLICT(user_id) DO UPDATE SET profile = excluded.profile, updated_at = excluded.updated_at',
+                        rows
+                    )
+                return len(rows)
+            except Exception as e:
+                print(f"Error writing user profiles: {e}")
+                if isinstance(e, sqlite3.Error):
+                    # e.g. the file was locked for too long; the next flush tries again
+                    self._requeue(pending)
+                return 0
+            finally:
+                conn.close()
+
+    def _requeue(self, pending):
+        # Put a batch that couldn't be written back in front of anything queued meanwhile
+        with self._lock:
+            for user_id, updates in pending.items():
+                self._pending[user_id][:0] = updates
+                self._pending_count += len(updates)
+
+    def import_profiles(self, profiles):
+        """Store whole profiles for users that don't have one yet, e.g. from an old model file"""
+        conn = self._connect()
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO user_profiles (user_id, profile, updated_at) VALUES (?, ?, ?)',
+                [(str(user_id), json.dumps(profile, default=str), time.time())
+                 for user_id, profile in profiles.items()]
+            )
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM user_profiles').fetchone()[0]
+        finally:
+            conn.close()
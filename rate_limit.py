@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import time
+
+from sqlite_helpers import connect, write_transaction
+
+SECONDS_PER_DAY = 86400
+
+
+class QuotaLimiter:
+    """Token-bucket limiter for upstream API calls, shared by every worker on a host.
+
+    Bucket state lives in a small SQLite file so all gunicorn workers draw from
+    the same daily budget. There is one global bucket sized to the daily quota
+    plus an optional bucket per route. Critical callers may drain the global
+    bucket completely; non-critical callers are refused once it drops below the
+    reserve, so the remaining quota is kept for the pages that need it.
+    """
+
+    GLOBAL = '__global__'
+
+    def __init__(self, path, daily_quota, route_budgets=None, reserve=0.2):
+        self.path = path
+        self.daily_quota = daily_quota
+        self.route_budgets = route_budgets or {}
+        self.reserve = reserve
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets '
+                '(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _buckets(self, route):
+        """Return (name, daily budget) for every bucket a call on this route draws from"""
+        buckets = [(self.GLOBAL, self.daily_quota)]
+        if route in self.route_budgets:
+            buckets.append((route, self.route_budgets[route]))
+        return buckets
+
+    def _refill(self, tokens, updated_at, budget, now):
+        # Refill at budget/day, capped at one day's budget
+        return min(budget, tokens + (now - updated_at) * budget / SECONDS_PER_DAY)
+
+    def acquire(self, route=None, critical=True):
+        """Take one token for a call on `route`. Returns False if the call should not be made."""
+        if not self.daily_quota:
+            return True
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            # Two workers checking the same bucket at once must not both spend its last token
+            with write_transaction(conn):
+                updates = []
+                for name, budget in self._buckets(route):
+                    row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE name = ?', (name,)).fetchone()
+                    tokens = budget if row is None else self._refill(row[0], row[1], budget, now)
+                    floor = budget * self.reserve if name == self.GLOBAL and not critical else 0
+                    if tokens - 1 < floor:
+                        conn.execute('ROLLBACK')
+                        return False
+                    updates.append((name, tokens - 1, now))
+
+                conn.executemany(
+                    'INSERT INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                    updates
+                )
+            return True
+        except sqlite3.Error as e:
+            # Never take the site down because the limiter file is unavailable
+            print(f"Error updating quota limiter: {e}")
+            return True
+        finally:
+            conn.close()
+
+    def remaining(self):
+        """Return the tokens currently left in every configured bucket"""
+        now = time.time()
+        budgets = dict([(self.GLOBAL, self.daily_quota)] + list(self.route_budgets.items()))
+        conn = self._connect()
+        try:
+            rows = {name: (tokens, updated_at)
+                    for name, tokens, updated_at in conn.execute('SELECT name, tokens, updated_at FROM buckets')}
+        finally:
+            conn.close()
+
+        return {
+            'global' if name == self.GLOBAL else name:
+                round(self._refill(*rows[name], budget, now), 1) if name in rows else budget
+            for name, budget in budgets.items()
+        }
+
+
+def parse_route_budgets(value):
+    """Parse 'route=budget,route=budget' into a dict"""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        route, _, budget = item.partition('=')
+        budgets[route.strip()] = int(budget)
+    return budgets
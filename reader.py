@@ -0,0 +1,644 @@
+import collections
+import concurrent.futures
+import contextvars
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urljoin, urlparse, urlunparse, parse_qsl, urlencode
+
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+import soupsieve
+
+import outbound
+from cache import FRESH, STALE, SingleFlight
+
+# Publishers block requests without a browser-like user agent
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# Content types worth handing to the HTML parser; a missing header is given the benefit of the doubt
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Query parameters that only track where a click came from and never change the page:
+# anything starting with a prefix, and these exact names
+TRACKING_PREFIXES = ('utm_',)
+TRACKING_PARAMS = frozenset(('fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ocid', 'cmpid', 'ref', 'smid'))
+
+# Containers that usually hold the article body, most specific first
+CONTENT_SELECTORS = [
+    '[data-testid="article-body"]',
+    '[data-testid="article-content"]',
+    '.article__body',
+    '.article-body',
+    '.article__content',
+    '.article-content',
+    '.story__body',
+    '.story-body',
+    '.story-content',
+    '.post-content',
+    '.entry-content',
+    '.content-body',
+    'article',
+    '.article',
+    'main',
+    '#main-content',
+    '.main-content'
+]
+
+# Compiled once at import instead of on every select() call
+CONTENT_PATTERNS = {selector: soupsieve.compile(selector) for selector in CONTENT_SELECTORS}
+
+# Page furniture stripped before looking for the article body
+JUNK_PATTERN = soupsieve.compile(
+    'script, style, noscript, iframe, button, input, form, nav, header, footer, aside, '
+    '.ad, .advertisement, .social-share, .newsletter, .share, .related-articles, .sidebar'
+)
+
+TEXT_TAGS = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote']
+IMAGE_TYPES = ('img', 'figure')
+
+# Image URLs containing these are logos, trackers and placeholders rather than article images
+SKIP_IMAGE_PATTERNS = [
+    'icon', 'logo', 'avatar', 'thumb',
+    'placeholder', 'default', 'blank',
+    'bbcx/grey-placeholder',
+    'pixel.gif', 'spacer.gif'
+]
+
+# Looser check for falling back to the feed's preview image
+PLACEHOLDER_PATTERNS = [
+    'placeholder', 'default', 'blank',
+    'bbcx/grey-placeholder',
+    'pixel.gif', 'spacer.gif'
+]
+
+SKIP_TEXT_CLASSES = ['nav', 'menu', 'share', 'meta', 'tag']
+
+# BeautifulSoup tree builders in order of preference; lxml is much faster but optional
+PARSER_BACKENDS = ['lxml', 'html.parser']
+
+
+def resolve_parser(preferred=None):
+    """Return the first installed parser backend, trying `preferred` first"""
+    if preferred and not builder_registry.lookup(preferred):
+        print(f"HTML parser '{preferred}' is not available, falling back")
+    for name in ([preferred] if preferred else []) + PARSER_BACKENDS:
+        if builder_registry.lookup(name):
+            return name
+    return 'html.parser'
+
+
+DEFAULT_PARSER = resolve_parser()
+
+
+def canonical_url(url):
+    """Normalize an article URL so trivially different links share one cache entry"""
+    parsed = urlparse(url.strip())
+    query = [(key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+             if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)]
+    return urlunparse((
+        parsed.scheme.lower(),
+        parsed.netloc.lower(),
+        parsed.path or '/',
+        parsed.params,
+        urlencode(sorted(query)),
+        ''  # Fragments never reach the server
+    ))
+
+
+def looks_like_placeholder(img_url, patterns=SKIP_IMAGE_PATTERNS):
+    return any(skip in img_url.lower() for skip in patterns)
+
+
+def check_image(img_url):
+    """HEAD an image URL and report whether it is an image and how big it is"""
+    img_response = outbound.head(img_url, headers=HEADERS, timeout=2)
+    content_type = img_response.headers.get('content-type', '')
+    content_length = img_response.headers.get('content-length', '')
+    return {
+        'is_image': content_type.startswith('image/'),
+        'size': int(content_length) if content_length.isdigit() else None
+    }
+
+
+def is_valid_check(result):
+    # Has to be an image and have a reasonable size (>1KB)
+    return bool(result) and result['is_image'] and (result['size'] or 0) > 1000
+
+
+class ImageValidator:
+    """Validates reader-mode images with concurrent HEAD requests.
+
+    Results are cached per image URL and shared by both reader routes. At
+    most ``per_host`` checks run against one host at a time; the rest wait
+    in a per-host queue rather than in a pool thread, so a slow host can't
+    hold up checks for other hosts. A batch gives up on whatever hasn't
+    answered within ``budget`` seconds (those checks finish in the
+    background and are cached for the next reader).
+    """
+
+    # Network errors may be transient, so they are only remembered briefly
+    ERROR_TTL = 60
+
+    def __init__(self, cache, max_workers=16, per_host=4, budget=3.0):
+        self.cache = cache
+        self.per_host = per_host
+        self.budget = budget
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='image-check')
+        # Checks running per host, and those waiting for one of its slots
+        self._host_running = {}
+        self._host_queues = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def check(self, img_url):
+        """Return the cached or freshly fetched check result for one image URL"""
+        cached = self.cache.get(img_url)
+        if cached is not None:
+            return cached
+        return self._flight.do(img_url, self._check_and_store, img_url)
+
+    def _check_and_store(self, img_url):
+        try:
+            result = check_image(img_url)
+            self.cache.set(img_url, result)
+        except (outbound.DeadlineExceededError, outbound.CircuitOpenError):
+            # The calling request's budget or the host's breaker, not the image; the cache is
+            # shared with every worker, so leave it for a check that actually gets to ask
+            raise
+        except Exception:
+            result = {'is_image': False, 'size': None}
+            self.cache.set(img_url, result, ttl=self.ERROR_TTL)
+        return result
+
+    def _submit(self, img_url):
+        """Run check(img_url) in the pool once its host has a free slot. Returns a Future."""
+        # Copy the context so checks share the request's outbound deadline
+        job = (concurrent.futures.Future(), img_url, contextvars.copy_context())
+        host = urlparse(img_url).netloc.lower()
+        with self._lock:
+            if self._host_running.get(host, 0) >= self.per_host:
+                self._host_queues.setdefault(host, collections.deque()).append(job)
+                return job[0]
+            self._host_running[host] = self._host_running.get(host, 0) + 1
+        self._executor.submit(self._run_host, host, job)
+        return job[0]
+
+    def _run_host(self, host, job):
+        """Run a check, then the host's queued ones, until the host has none waiting"""
+        while True:
+            future, img_url, context = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(context.run(self.check, img_url))
+                except Exception as e:
+                    future.set_exception(e)
+            with self._lock:
+                queue = self._host_queues.get(host)
+                if not queue:
+                    self._host_queues.pop(host, None)
+                    self._host_running[host] -= 1
+                    if not self._host_running[host]:
+                        del self._host_running[host]
+                    return
+                job = queue.popleft()
+
+    def validate_many(self, img_urls):
+        """Check many image URLs at once. Returns {url: is_valid}; unanswered URLs are invalid."""
+        results = {}
+        futures = {}
+        for img_url in dict.fromkeys(img_urls):
+            cached = self.cache.get(img_url)
+            if cached is not None:
+                results[img_url] = is_valid_check(cached)
+            else:
+                futures[self._submit(img_url)] = img_url
+
+        budget = self.budget
+        remaining = outbound.remaining_time()
+        if remaining is not None:
+            budget = max(0, min(budget, remaining))
+
+        done, _ = concurrent.futures.wait(futures, timeout=budget)
+        for future, img_url in futures.items():
+            results[img_url] = future in done and future.exception() is None and is_valid_check(future.result())
+        return results
+
+
+class PageRejectedError(Exception):
+    """Raised when a publisher page isn't HTML or is too big to parse"""
+
+
+def page_validators(response):
+    """The response's cache validators, as fetch_page keyword arguments"""
+    validators = {}
+    if response.headers.get('ETag'):
+        validators['etag'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        validators['last_modified'] = response.headers['Last-Modified']
+    return validators
+
+
+def fetch_page(url, max_bytes, etag=None, last_modified=None):
+    """Stream a publisher page, rejecting non-HTML responses before and huge ones while reading.
+
+    Returns (response, body bytes). With `etag` or `last_modified` the request
+    is conditional, and body is None if the publisher answers 304 Not Modified.
+    The connection is closed as soon as the page is rejected.
+    """
+    headers = dict(HEADERS)
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    with outbound.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304 and (etag or last_modified):
+            return response, None
+        content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            raise PageRejectedError(f"Not an HTML page ({content_type})")
+        try:
+            body = outbound.read_limited(response, max_bytes)
+        except outbound.ResponseTooLargeError:
+            raise PageRejectedError(f"Page is over the {max_bytes} byte limit")
+    return response, body
+
+
+def page_title(soup):
+    og_title = soup.find('meta', property='og:title')
+    if og_title and og_title.get('content'):
+        return og_title['content'].strip()
+    if soup.title and soup.title.string:
+        return soup.title.string.strip()
+    return None
+
+
+class SelectorRules:
+    """Per-domain rule table: the content selector that matched last time is tried first"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def selectors(self, domain):
+        learned = self.cache.get(domain)
+        if learned not in CONTENT_PATTERNS:
+            return CONTENT_SELECTORS
+        return [learned] + [selector for selector in CONTENT_SELECTORS if selector != learned]
+
+    def learn(self, domain, selector):
+        if self.cache.get(domain) != selector:
+            self.cache.set(domain, selector)
+
+
+def find_container(soup, selectors):
+    """Return (selector, element) for the first selector matching an element with paragraphs"""
+    for selector in selectors:
+        element = CONTENT_PATTERNS[selector].select_one(soup)
+        if element and element.find('p'):
+            return selector, element
+
+    # Fallback to largest paragraph cluster
+    parent_count = {}
+    for p in soup.find_all('p'):
+        if p.parent:
+            parent_count[p.parent] = parent_count.get(p.parent, 0) + 1
+    if parent_count:
+        return None, max(parent_count.keys(), key=lambda x: parent_count[x])
+    return None, None
+
+
+def image_block(img, url, caption=None):
+    src = img.get('src')
+    if not src:
+        return None
+    src = urljoin(url, src)
+    if looks_like_placeholder(src):
+        return None
+    block = {'type': 'figure' if caption is not None else 'img', 'src': src, 'alt': img.get('alt') or ''}
+    if caption is not None:
+        block['caption'] = caption
+    return block
+
+
+def text_block(element):
+    """Turn a paragraph/heading element into a content block, skipping navigation and metadata"""
+    # Skip empty elements or those containing only whitespace/special characters
+    text = element.get_text(strip=True)
+    if not text or text.isspace() or len(text) <= 1:
+        return None
+    if any(skip in str(element.get('class', [])).lower() for skip in SKIP_TEXT_CLASSES):
+        return None
+    return {'type': element.name, 'content': text}
+
+
+def page_domain(url):
+    return urlparse(url).netloc.lower().removeprefix('www.')
+
+
+def extract_with_selectors(html, url, parser, selectors):
+    """Extract a page trying content `selectors` in order. Returns (extracted, matched selector)."""
+    soup = BeautifulSoup(html, parser)
+    title = page_title(soup)
+
+    for element in JUNK_PATTERN.select(soup):
+        element.decompose()
+
+    selector, container = find_container(soup, selectors)
+    if container is None:
+        return {'title': title, 'found_main': False, 'blocks': []}, None
+
+    blocks = []
+    for element in container.find_all(TEXT_TAGS + list(IMAGE_TYPES)):
+        if element.name == 'figure':
+            # Images within figures keep their caption
+            img = element.find('img')
+            caption = element.find(['figcaption', 'caption'])
+            block = img and image_block(img, url, caption.get_text(strip=True) if caption else '')
+        elif element.find_parent(['figure', 'blockquote']):
+            # Already part of a figure or quote block
+            continue
+        elif element.name == 'img':
+            block = image_block(element, url)
+        else:
+            block = text_block(element)
+        if block:
+            blocks.append(block)
+
+    return {'title': title, 'found_main': selector is not None, 'blocks': blocks}, selector
+
+
+def extract_article(html, url, parser=DEFAULT_PARSER, rules=None):
+    """Extract the title and ordered text and image blocks of a publisher page.
+
+    Used by both reader routes. `found_main` is False when no content selector
+    matched and the blocks come from the largest cluster of paragraphs.
+    """
+    domain = page_domain(url)
+    extracted, selector = extract_with_selectors(
+        html, url, parser, rules.selectors(domain) if rules else CONTENT_SELECTORS
+    )
+    if selector and rules:
+        rules.learn(domain, selector)
+    return extracted
+
+
+def extract_page(body, encoding, url, parser, selectors):
+    """Decode and extract fetched page bytes. Runs in the extraction process pool."""
+    return extract_with_selectors(str(body, encoding, errors='replace'), url, parser, selectors)
+
+
+# In a parser process: the pool's shared array of parse start times, one slot per submitted job
+_parse_started = None
+
+
+def init_parse_worker(started):
+    global _parse_started
+    _parse_started = started
+
+
+def timed_extract_page(slot, *args):
+    """extract_page in a parser process, with its start time in `slot` while it runs"""
+    _parse_started[slot] = time.monotonic()
+    try:
+        return extract_page(*args)
+    finally:
+        _parse_started[slot] = 0
+
+
+def text_blocks(blocks):
+    return [block for block in blocks if block['type'] not in IMAGE_TYPES]
+
+
+def drop_invalid_images(blocks, validator):
+    """Remove image blocks whose image fails validation; checks run concurrently"""
+    valid = validator.validate_many(block['src'] for block in blocks if block['type'] in IMAGE_TYPES)
+    return [block for block in blocks if block['type'] not in IMAGE_TYPES or valid[block['src']]]
+
+
+def choose_images(extracted, preview_image, title, validator, max_candidates=8):
+    """Pick the lead image for /read_article: a valid preview, else the first valid article image"""
+    if not extracted['found_main']:
+        # Use preview image if available
+        return [{'src': preview_image, 'alt': title, 'caption': ''}] if preview_image else []
+
+    # Check the preview and the first few article images together, then pick in order
+    check_preview = bool(preview_image) and not looks_like_placeholder(preview_image)
+    candidates = [block for block in extracted['blocks'] if block['type'] in IMAGE_TYPES][:max_candidates]
+    valid = validator.validate_many(
+        ([preview_image] if check_preview else []) + [image['src'] for image in candidates]
+    )
+
+    if check_preview and valid[preview_image]:
+        return [{'src': preview_image, 'alt': title, 'caption': ''}]
+
+    for image in candidates:
+        if valid[image['src']]:
+            return [{'src': image['src'], 'alt': image['alt'], 'caption': image.get('caption', '')}]
+
+    # If no valid image found and we have a preview image, use it
+    if preview_image and not looks_like_placeholder(preview_image, PLACEHOLDER_PATTERNS):
+        return [{'src': preview_image, 'alt': title, 'caption': ''}]
+    return []
+
+
+class ArticleExtractor:
+    """Fetches and extracts publisher pages, caching the result per canonical URL.
+
+    With `processes` set, pages of `inline_bytes` or more are parsed in a
+    process pool so a heavy parse doesn't hold the worker's GIL; only the page
+    bytes go in and the extracted blocks come back. A parse that has been
+    running for `parse_timeout` seconds is abandoned and the pool, whose
+    process is still busy with it, is killed and replaced; the other parses
+    it was running are retried on the new pool. A request that runs out of
+    time while its page is queued or parsing just stops waiting.
+    """
+
+    # Slots in each pool's shared array of parse start times, reused round-robin
+    PARSE_SLOTS = 256
+
+    def __init__(self, cache, rules=None, parser=None, max_bytes=3 * 1024 * 1024,
+                 prefetch_workers=2, max_pending=32, processes=0, parse_timeout=10, inline_bytes=32 * 1024,
+                 background_deadline=15):
+        self.cache = cache
+        self.rules = rules
+        self.parser = resolve_parser(parser)
+        self.max_bytes = max_bytes
+        self.processes = processes
+        self.parse_timeout = parse_timeout
+        self.inline_bytes = inline_bytes
+        self.background_deadline = background_deadline
+        self._pool = self._new_pool()
+        self._pool_lock = threading.Lock()
+        self._parse_slots = itertools.count()
+        # Many readers opening the same story at once share one fetch and parse,
+        # each waiting for it no longer than its own outbound deadline allows
+        self._flight = SingleFlight(wait_timeout=outbound.remaining_time)
+        self._prefetcher = concurrent.futures.ThreadPoolExecutor(prefetch_workers, thread_name_prefix='prefetch')
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self.max_pending = max_pending
+
+    def cache_key(self, url):
+        # Entries hold the extraction plus the publisher's cache validators
+        return f"page:{canonical_url(url)}"
+
+    def extract(self, url):
+        key = self.cache_key(url)
+        entry = self.cache.lookup(key, include_expired=True)
+        if entry is not None:
+            cached, state = entry
+            if state == FRESH:
+                return cached['extracted']
+            if state == STALE:
+                # Serve the copy we have and check with the publisher in the background
+                self._queue(key, url, cached)
+                return cached['extracted']
+        return self._flight.do(key, self._fetch_and_extract, key, url, entry and entry[0])
+
+    def prefetch(self, urls):
+        """Extract pages in the background ahead of a likely click. Returns how many were queued.
+
+        Pages already fresh in the cache or queued are skipped, expired ones
+        are revalidated with the publisher, and once `max_pending` pages are
+        waiting new ones are dropped rather than queued.
+        """
+        queued = 0
+        for url in urls:
+            key = self.cache_key(url)
+            entry = self.cache.lookup(key, include_expired=True)
+            if entry is not None and entry[1] == FRESH:
+                continue
+            if self._queue(key, url, entry and entry[0]):
+                queued += 1
+        return queued
+
+    def _queue(self, key, url, cached=None):
+        with self._pending_lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(key)
+        self._prefetcher.submit(self._fetch_in_background, key, url, cached)
+        return True
+
+    def _fetch_in_background(self, key, url, cached):
+        # Outside any request, so prefetches and revalidations get a time budget of their own
+        token = outbound.start_deadline(self.background_deadline)
+        try:
+            # Through the single flight, so a click during the fetch waits for it instead of refetching
+            self._flight.do(key, self._fetch_and_extract, key, url, cached)
+        except Exception as e:
+            print(f"Error fetching {url} in the background: {e}")
+        finally:
+            outbound.clear_deadline(token)
+            self._done(key)
+
+    def _done(self, key):
+        with self._pending_lock:
+            self._pending.discard(key)
+
+    def _new_pool(self):
+        if not self.processes:
+            return None
+        # Spawned rather than forked: forking a threaded web worker can copy held locks
+        context = multiprocessing.get_context('spawn')
+        # The parser processes record in here when each parse starts, so time spent queued
+        # behind other pages doesn't count against a page's parse_timeout
+        started = context.Array('d', self.PARSE_SLOTS, lock=False)
+        pool = concurrent.futures.ProcessPoolExecutor(
+            self.processes, mp_context=context, initializer=init_parse_worker, initargs=(started,)
+        )
+        pool.parse_started = started
+        return pool
+
+    def _recycle_pool(self, pool):
+        """Replace `pool` with a fresh one and stop its processes, unless another thread already has"""
+        with self._pool_lock:
+            if self._pool is not pool:
+                return
+            self._pool = self._new_pool()
+        # A parse that has started can't be cancelled, so its process is killed instead; other
+        # parses on the old pool see BrokenProcessPool and are retried on the new one
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+
+    def _overrunning(self, pool):
+        """Whether any parse in `pool` has been running for parse_timeout or longer"""
+        now = time.monotonic()
+        return any(started and now - started >= self.parse_timeout for started in pool.parse_started)
+
+    def _extract(self, body, encoding, url, selectors):
+        args = (body, encoding, url, self.parser, selectors)
+        # Small pages parse faster than they can be shipped to another process
+        if self._pool is None or len(body) < self.inline_bytes:
+            return extract_page(*args)
+
+        # Tried again on a fresh pool if the one it was in is killed or breaks
+        for _ in range(2):
+            pool = self._pool
+            slot = next(self._parse_slots) % self.PARSE_SLOTS
+            try:
+                future = pool.submit(timed_extract_page, slot, *args)
+            except RuntimeError:
+                # Shut down by another thread since we took it
+                continue
+            try:
+                return self._wait_for_parse(pool, future, slot, url)
+            except (BrokenProcessPool, concurrent.futures.CancelledError):
+                # A parser process died (e.g. killed for memory) or the pool was recycled under it
+                print(f"Extraction process pool broke while parsing {url}, retrying on a new one")
+                self._recycle_pool(pool)
+        raise PageRejectedError("Page could not be parsed")
+
+    def _wait_for_parse(self, pool, future, slot, url):
+        remaining = outbound.remaining_time()
+        give_up = None if remaining is None else time.monotonic() + remaining
+        while True:
+            started = pool.parse_started[slot]
+            # While queued, look again after a parse_timeout: something ahead may be overrunning
+            wait = self.parse_timeout - (time.monotonic() - started if started else 0)
+            if give_up is not None:
+                wait = min(wait, give_up - time.monotonic())
+            try:
+                return future.result(timeout=max(0, wait))
+            except concurrent.futures.TimeoutError:
+                pass
+
+            started = pool.parse_started[slot]
+            if started and time.monotonic() - started >= self.parse_timeout:
+                print(f"Parsing {url} took longer than {self.parse_timeout:g}s, restarting the extraction process pool")
+                self._recycle_pool(pool)
+                raise PageRejectedError(f"Page took longer than {self.parse_timeout:g}s to parse")
+            if give_up is not None and time.monotonic() >= give_up:
+                # The request is out of time, not the parser; leave the pool alone
+                future.cancel()
+                raise PageRejectedError("Request ran out of time waiting for the page to parse")
+            if not started and self._overrunning(pool):
+                # Queued behind a parse whose own request stopped waiting for it
+                print(f"A parse overran while {url} was queued, restarting the extraction process pool")
+                self._recycle_pool(pool)
+
+    def _fetch_and_extract(self, key, url, cached=None):
+        """Fetch and extract a page, revalidating `cached` (a previous cache entry) if given"""
+        response, body = fetch_page(url, self.max_bytes, **(cached or {}).get('validators', {}))
+        if body is None:
+            # 304: the page hasn't changed since we extracted it, so just extend the entry's lifetime,
+            # keeping any validators the publisher sent with it
+            self.cache.set(key, dict(cached, validators={**cached.get('validators', {}), **page_validators(response)}))
+            return cached['extracted']
+
+        domain = page_domain(url)
+        selectors = self.rules.selectors(domain) if self.rules else CONTENT_SELECTORS
+        extracted, selector = self._extract(body, response.encoding or 'utf-8', url, selectors)
+        if selector and self.rules:
+            self.rules.learn(domain, selector)
+        # Error pages are worth parsing for this request but not worth remembering
+        if response.ok:
+            self.cache.set(key, {'extracted': extracted, 'validators': page_validators(response)})
+        return extracted
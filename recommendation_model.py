@@ -1,21 +1,123 @@
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
 from collections import defaultdict
 import joblib
 import os
 
+from article_index import ArticleIndex
+from cache import TTLCache
+from profile_store import ProfileStore
+
+def article_text(article):
+    return f"{article.get('title', '')} {article.get('description', '')}"
+
+# Same tokens as both vectorizers: unigrams and bigrams without English stop words
+analyze = TfidfVectorizer(stop_words='english', ngram_range=(1, 2)).build_analyzer()
+
+# How much each term occurrence counts towards a user profile
+QUERY_WEIGHT = 10
+TITLE_WEIGHT = 5
+DESCRIPTION_WEIGHT = 3
+
+# Every new interaction shrinks the weight of everything before it by this much
+PROFILE_DECAY = 0.9
+# Profiles are renormalized (and trimmed) once the running scale passes this
+RESCALE_AT = 1e6
+MAX_PROFILE_TERMS = 2000
+
+HASHING_FEATURES = 2 ** 18
+
+def interaction_terms(search_query, articles):
+    """Weighted term counts for one interaction"""
+    terms = defaultdict(float)
+    for text, weight in [(search_query, QUERY_WEIGHT)] + [
+        (text, weight)
+        for article in articles
+        for text, weight in ((article.get('title'), TITLE_WEIGHT), (article.get('description'), DESCRIPTION_WEIGHT))
+    ]:
+        for term in analyze(text or ''):
+            terms[term] += weight
+    return dict(terms)
+
+def apply_interaction(profile, update):
+    """Fold an interaction into a user's decayed term-weight profile in O(terms of the interaction).
+
+    Stored weights are all relative to ``scale``. Rather than decaying every
+    existing weight, the scale grows by 1/PROFILE_DECAY and new weights are
+    added at that scale; true weight = stored weight / scale.
+    """
+    if isinstance(profile, list):
+        # Profiles stored as a list of raw interactions: replay them oldest first
+        legacy, profile = profile, None
+        for interaction in legacy:
+            profile = apply_interaction(profile, {
+                'terms': interaction_terms(interaction.get('query'), interaction.get('articles', [])),
+                'category': interaction.get('category')
+            })
+    profile = profile or {'scale': 1.0, 'terms': {}, 'categories': {}}
+
+    scale = profile['scale'] / PROFILE_DECAY
+    terms = profile['terms']
+    for term, weight in update['terms'].items():
+        terms[term] = terms.get(term, 0.0) + weight * scale
+    if update.get('category'):
+        categories = profile['categories']
+        categories[update['category']] = categories.get(update['category'], 0.0) + scale
+    profile['scale'] = scale
+
+    if scale > RESCALE_AT or len(terms) > 2 * MAX_PROFILE_TERMS:
+        profile = rescale_profile(profile)
+    return profile
+
+def rescale_profile(profile):
+    """Bring stored weights back to scale 1, keeping the heaviest terms"""
+    scale = profile['scale']
+    top = sorted(profile['terms'].items(), key=lambda item: item[1], reverse=True)[:MAX_PROFILE_TERMS]
+    return {
+        'scale': 1.0,
+        'terms': {term: weight / scale for term, weight in top if weight / scale > 1e-6},
+        'categories': {category: weight / scale for category, weight in profile['categories'].items()}
+    }
+
 class RecommendationModel:
-    def __init__(self):
+    """Content-based recommendations from TF-IDF similarity to a user's history.
+
+    The vocabulary is fitted offline with fit_vocabulary() (see the
+    fit-recommendation-vocabulary CLI command) and only used to transform on
+    the request path. Until one has been fitted, a stateless hashing vectorizer
+    is used instead. Either way article vectors are cached by URL, so scores
+    are comparable across requests. For candidate pools too big to score in
+    full, articles can also be kept in an approximate nearest-neighbour index
+    (index_articles / get_indexed_recommendations).
+    """
+
+    def __init__(self, profile_store=None, vector_cache_size=4096, vector_cache_ttl=86400, article_index=None):
         self.vectorizer = TfidfVectorizer(
             stop_words='english',
             max_features=5000,  # Limit features for better performance
             ngram_range=(1, 2)  # Use both unigrams and bigrams
         )
-        self.user_profiles = defaultdict(list)
-        self.article_vectors = None
-        self.articles = []
+        # Used until a vocabulary has been fitted; needs no state and no fitting
+        self.hashing_vectorizer = HashingVectorizer(
+            stop_words='english',
+            ngram_range=(1, 2),
+            n_features=HASHING_FEATURES,
+            alternate_sign=False
+        )
+        # Maps profile terms to the same columns the hashing vectorizer uses
+        self.feature_hasher = FeatureHasher(n_features=HASHING_FEATURES, input_type='dict', alternate_sign=False)
+        self.article_vectors = TTLCache(max_entries=vector_cache_size, ttl=vector_cache_ttl)
         self.model_path = 'recommendation_model.joblib'
+        # The nearest-neighbour index is only loaded by the batch job that uses it
+        self.index_path = 'article_index.joblib'
+        # Profiles are persisted per user; the model file only holds the vectorizer
+        if profile_store is None:
+            profile_store = ProfileStore('recommendation_profiles.db', apply_interaction)
+        self.profiles = profile_store
+        self.article_index = article_index if article_index is not None else ArticleIndex()
         
         # Load existing model if it exists
         if os.path.exists(self.model_path):
@@ -23,123 +125,218 @@ class RecommendationModel:
 
     def update_user_profile(self, user_id, search_query, article_data):
         """Update user profile with new search and article interactions"""
-        # Create new interaction with weight
-        new_interaction = {
-            'query': search_query,
-            'timestamp': article_data.get('timestamp'),
-            'category': article_data.get('category'),
-            'articles': article_data.get('articles', []),
-            'weight': 1.0  # New interactions start with full weight
+        # Tokenize just this interaction; the stored profile is updated in place, never rebuilt
+        update = {
+            'terms': interaction_terms(search_query, article_data.get('articles', [])),
+            'category': article_data.get('category')
         }
         
-        # Add new interaction
-        self.user_profiles[user_id].append(new_interaction)
-        
-        # Decay weights of older interactions
-        for i in range(len(self.user_profiles[user_id]) - 1):
-            if 'weight' not in self.user_profiles[user_id][i]:
-                self.user_profiles[user_id][i]['weight'] = 1.0
-            self.user_profiles[user_id][i]['weight'] *= 0.9
-        
-        # Keep only last 50 interactions
-        if len(self.user_profiles[user_id]) > 50:
-            self.user_profiles[user_id] = self.user_profiles[user_id][-50:]
-        
-        self.save_model()
+        # Written behind in a batch with other users' changes, not by re-saving the whole model
+        self.profiles.update(user_id, update)
 
     def get_user_preferences(self, user_id):
-        """Extract user preferences from their history"""
-        if user_id not in self.user_profiles:
+        """Return a user's decayed term weights and most frequent category"""
+        return self.preferences(self.profiles.get(user_id))
+
+    def preferences(self, profile):
+        if not profile:
             return None
+        if isinstance(profile, list):
+            profile = apply_interaction(profile, {'terms': {}})
         
-        # Combine all user's searches and article interactions with weights
-        all_text = []
-        categories = defaultdict(float)
-        
-        for interaction in self.user_profiles[user_id]:
-            weight = interaction['weight']
-            if interaction['query']:
-                all_text.extend([interaction['query']] * int(weight * 10))
-            if interaction['category']:
-                categories[interaction['category']] += weight
-            for article in interaction['articles']:
-                if article.get('title'):
-                    all_text.extend([article['title']] * int(weight * 5))
-                if article.get('description'):
-                    all_text.extend([article['description']] * int(weight * 3))
-        
-        # Get most frequent category
-        preferred_category = max(categories.items(), key=lambda x: x[1])[0] if categories else None
+        scale = profile['scale']
+        categories = profile['categories']
         
         return {
-            'text_profile': ' '.join(all_text),
-            'preferred_category': preferred_category
+            'terms': {term: weight / scale for term, weight in profile['terms'].items()},
+            'preferred_category': max(categories, key=categories.get) if categories else None
         }
 
+    def profile_vector(self, terms):
+        """Turn profile term weights into a 1 x features row in the same space as the article vectors"""
+        if not self.is_fitted():
+            return self.feature_hasher.transform([terms])
+        
+        # Terms outside the fitted vocabulary can't match any article
+        vocabulary = self.vectorizer.vocabulary_
+        columns = [vocabulary[term] for term in terms if term in vocabulary]
+        weights = [weight for term, weight in terms.items() if term in vocabulary]
+        values = np.asarray(weights) * self.vectorizer.idf_[columns]
+        return sp.csr_matrix((values, ([0] * len(columns), columns)), shape=(1, len(vocabulary)))
+
+    def is_fitted(self):
+        return hasattr(self.vectorizer, 'vocabulary_')
+
+    def fit_vocabulary(self, texts):
+        """Fit the TF-IDF vocabulary offline on a corpus of article texts"""
+        self.vectorizer.fit(texts)
+        # Vectors from the previous vocabulary aren't comparable with new ones
+        self.article_vectors.clear()
+        self.article_index.clear()
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        self.save_model()
+
+    def transform(self, texts):
+        """Vectorize texts without refitting anything"""
+        if self.is_fitted():
+            return self.vectorizer.transform(texts)
+        return self.hashing_vectorizer.transform(texts)
+
+    def vectorize_articles(self, articles):
+        """Return a sparse matrix with one row per article, reusing vectors cached by URL"""
+        rows = [None] * len(articles)
+        missing = []
+        for i, article in enumerate(articles):
+            vector = self.article_vectors.get(article.get('url') or article_text(article))
+            if vector is None:
+                missing.append(i)
+            else:
+                rows[i] = vector
+
+        if missing:
+            # One transform call for everything not yet cached
+            vectors = self.transform([article_text(articles[i]) for i in missing])
+            for i, vector in zip(missing, vectors):
+                rows[i] = vector
+                self.article_vectors.set(articles[i].get('url') or article_text(articles[i]), vector)
+
+        return sp.vstack(rows, format='csr')
+
     def get_recommendations(self, user_id, available_articles, num_recommendations=6):
         """Get personalized recommendations for user"""
         try:
             # If no articles available, return empty list
             if not available_articles:
                 return []
-
-            # Get user preferences
-            user_prefs = self.get_user_preferences(user_id)
-            
-            # If no user preferences, return random selection
-            if not user_prefs:
-                return available_articles[:num_recommendations]
-            
-            # Vectorize available articles
-            article_texts = [
-                f"{a.get('title', '')} {a.get('description', '')}"
-                for a in available_articles
-            ]
-            
-            if not article_texts:
-                return available_articles[:num_recommendations]
-            
-            # Add user profile to get similarity
-            all_texts = article_texts + [user_prefs.get('text_profile', '')]
-            
-            try:
-                vectors = self.vectorizer.fit_transform(all_texts)
-                
-                # Calculate similarity between user profile and articles
-                user_vector = vectors[-1]
-                article_vectors = vectors[:-1]
-                similarities = cosine_similarity(user_vector, article_vectors).flatten()
-                
-                # Get top articles
-                top_indices = similarities.argsort()[-num_recommendations:][::-1]
-                recommended_articles = [available_articles[i] for i in top_indices]
-                
-                return recommended_articles
-                
-            except Exception as e:
-                print(f"Vectorization error: {e}")
-                return available_articles[:num_recommendations]
+            return self.get_batch_recommendations([user_id], available_articles, num_recommendations)[user_id]
                 
         except Exception as e:
             print(f"Error in get_recommendations: {e}")
             return available_articles[:num_recommendations]
 
+    def get_batch_recommendations(self, user_ids, available_articles, num_recommendations=6, batch_size=1024):
+        """Recommend from the same candidate articles for many users at once. Returns {user_id: articles}.
+
+        Scores each batch of users against every article with one sparse
+        matrix multiplication and picks each user's top k with argpartition.
+        Users without a profile get the first articles, as in get_recommendations.
+        """
+        if not available_articles:
+            return {user_id: [] for user_id in user_ids}
+
+        # Rows are unit length, so dot products are cosine similarities
+        article_vectors = normalize(self.vectorize_articles(available_articles))
+        k = min(num_recommendations, len(available_articles))
+        recommendations = {}
+
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            stored = self.profiles.get_many(batch)
+            profiles = []
+            for user_id in batch:
+                user_prefs = self.preferences(stored.get(str(user_id)))
+                if user_prefs:
+                    profiles.append((user_id, self.profile_vector(user_prefs['terms'])))
+                else:
+                    recommendations[user_id] = available_articles[:num_recommendations]
+            if not profiles:
+                continue
+
+            user_vectors = normalize(sp.vstack([vector for _, vector in profiles], format='csr'))
+            scores = (user_vectors @ article_vectors.T).toarray()
+
+            # Top k per row without sorting every article, then order just those k
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            top = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+
+            for (user_id, _), indices in zip(profiles, top):
+                recommendations[user_id] = [available_articles[i] for i in indices]
+
+        return recommendations
+
+    def index_articles(self, articles):
+        """Add articles not yet in the nearest-neighbour index, keyed by URL. Returns how many were added."""
+        new = [article for article in articles if (article.get('url') or article_text(article)) not in self.article_index]
+        if new:
+            # Straight to transform, so a big batch doesn't evict the request path's cached vectors
+            self.article_index.add(
+                [article.get('url') or article_text(article) for article in new],
+                self.transform([article_text(article) for article in new]),
+                new
+            )
+        return len(new)
+
+    def get_indexed_recommendations(self, user_ids, num_recommendations=6, probes=8):
+        """Recommend from every indexed article without scoring them all. Returns {user_id: articles}.
+
+        Only articles in the `probes` index clusters closest to the user's
+        profile are scored, so results may miss some of the exact top matches;
+        raise `probes` for better recall at the cost of speed. Users without a
+        profile get an empty list.
+        """
+        recommendations = {user_id: [] for user_id in user_ids}
+        stored = self.profiles.get_many(user_ids)
+        profiles = []
+        for user_id in user_ids:
+            user_prefs = self.preferences(stored.get(str(user_id)))
+            if user_prefs:
+                profiles.append((user_id, self.profile_vector(user_prefs['terms'])))
+        if not profiles or not len(self.article_index):
+            return recommendations
+
+        results = self.article_index.search(
+            sp.vstack([vector for _, vector in profiles], format='csr'), num_recommendations, probes
+        )
+        for (user_id, _), matches in zip(profiles, results):
+            recommendations[user_id] = [article for article, _ in matches]
+        return recommendations
+
     def save_model(self):
         """Save model state"""
         try:
             model_state = {
-                'user_profiles': dict(self.user_profiles),
                 'vectorizer': self.vectorizer
             }
-            joblib.dump(model_state, self.model_path)
+            # Write to a temp file and swap it in so a crash never leaves a truncated model
+            tmp_path = f"{self.model_path}.{os.getpid()}.tmp"
+            joblib.dump(model_state, tmp_path)
+            os.replace(tmp_path, self.model_path)
         except Exception as e:
             print(f"Error saving model: {e}")
 
+    def save_index(self, last_article_id):
+        """Save the nearest-neighbour index with the id of the last article in it"""
+        try:
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            joblib.dump({'index': self.article_index, 'last_article_id': last_article_id}, tmp_path)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"Error saving article index: {e}")
+
+    def load_index(self):
+        """Load the saved nearest-neighbour index. Returns the id of the last article in it, 0 if none."""
+        if not os.path.exists(self.index_path):
+            return 0
+        try:
+            index_state = joblib.load(self.index_path)
+            self.article_index = index_state['index']
+            return index_state['last_article_id']
+        except Exception as e:
+            print(f"Error loading article index: {e}")
+            self.article_index.clear()
+            return 0
+
     def load_model(self):
         """Load model state"""
         try:
             model_state = joblib.load(self.model_path)
-            self.user_profiles = defaultdict(list, model_state['user_profiles'])
             self.vectorizer = model_state['vectorizer']
+            if model_state.get('user_profiles'):
+                # Older model files carried every profile; move them into the profile store
+                self.profiles.import_profiles(model_state['user_profiles'])
+            self.article_vectors.clear()
+            self.article_index.clear()
         except Exception as e:
             print(f"Error loading model: {e}")
\ No newline at end of file
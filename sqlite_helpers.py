@@ -0,0 +1,27 @@
+"""Connection and transaction helpers shared by the SQLite-backed stores (quota limiter, user profiles)"""
+import sqlite3
+from contextlib import contextmanager
+
+
+def connect(path):
+    """Open `path` in autocommit mode, so transactions are only the ones opened explicitly"""
+    return sqlite3.connect(path, timeout=5, isolation_level=None)
+
+
+@contextmanager
+def write_transaction(conn):
+    """Run the block in a BEGIN IMMEDIATE transaction, committed on success and rolled back on error.
+
+    IMMEDIATE takes the database's write lock before the block's first read,
+    so a read-modify-write inside it can't interleave with another process's.
+    The block may end the transaction itself, e.g. with ROLLBACK.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    if conn.in_transaction:
+        conn.execute('COMMIT')